@@ -1,9 +1,15 @@
 import os
 import psycopg2
+import psycopg2.extras
+import threading
 import numpy as np
 from datetime import datetime
 import pytz
-from io import BytesIO
+from similarity_engine import invalidate_user
+import ann_index
+from ann_index import record_added, record_removed, record_file_deleted
+from db_pool import ConnectionPool, execute_prepared
+from embedding_codec import encode, decode_many, EMBEDDING_CODEC
 
 # Database Connection Parameters
 # DB_PARAMS = {
@@ -21,93 +27,134 @@ DB_PARAMS = {
     "port": "50013"
 }
 
-# Utility to get DB connection
+# Optional pgvector backend: top-k document search runs in SQL against a `vector` column.
+# The BYTEA embedding column is always written and stays the fallback.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "bytea")  # "bytea" or "pgvector"
+PGVECTOR_ENABLED = VECTOR_BACKEND == "pgvector"
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 1536))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", 100))  # HNSW candidate list size per query
+
+LOBJECT_CHUNK_SIZE = int(os.getenv("LOBJECT_CHUNK_SIZE", 256 * 1024))  # bytes per large-object read when streaming
+RECORD_ADDED_BATCH_SIZE = 1000  # rows per read when applying a rewritten file to the ANN index
+BLOB_GC_LOCK_KEY = 742_002  # advisory lock held by the large-object collector (migrations use 742_001)
+
+# Shared connection pool, created lazily per process (gunicorn workers fork after import)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Hot statements, PREPAREd server-side once per pooled connection
+PREPARED_STATEMENTS = {
+    "chat_history_by_chat": """
+        SELECT message, role FROM chat_history
+        WHERE user_id = $1 AND newchat_id = $2
+        ORDER BY id ASC
+    """,
+    "chat_history_recent": """
+        SELECT message, embedding, embedding_codec FROM chat_history
+        WHERE user_id = $1 AND newchat_id = $2
+        ORDER BY id DESC LIMIT $3
+    """,
+    "chat_messages_page": """
+        SELECT id, role, message FROM chat_history
+        WHERE user_id = $1 AND newchat_id = $2 AND ($3::integer IS NULL OR id < $3::integer)
+        ORDER BY id DESC LIMIT $4
+    """,
+    "document_embeddings_by_user": """
+        SELECT text_snippet, embedding, filename, embedding_codec FROM document_embeddings
+        WHERE user_id = $1
+    """,
+    "user_files_by_user": """
+        SELECT file_name, file_type, uploaded_at, file_path, id
+        FROM user_storage
+        WHERE user_id = $1
+    """,
+    "file_metadata_by_name": """
+        SELECT file_oid, id
+        FROM user_storage
+        WHERE user_id = $1 AND file_name = $2
+    """,
+}
+
+def get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(DB_PARAMS)
+            _pool_pid = os.getpid()
+        return _pool
+
+# Utility to get DB connection (close() returns it to the pool)
 def get_connection():
-    return psycopg2.connect(**DB_PARAMS)
+    return get_pool().getconn()
 
-# Initialize Database
-def init_db():
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username TEXT NOT NULL,
-                password TEXT UNIQUE NOT NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS document_embeddings (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id),
-                filename TEXT,
-                embedding BYTEA,
-                text_snippet TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id),
-                newchat_id TEXT,
-                embedding BYTEA,
-                message TEXT,
-                role TEXT CHECK(role IN ('user', 'assistant'))
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_storage (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id),
-                file_name TEXT,
-                file_type TEXT,
-                file_size INTEGER,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                used_space INTEGER DEFAULT 0,
-                file_path TEXT,
-                file_oid OID NOT NULL
-            )
-        """)
-        conn.commit()
-    except psycopg2.Error as e:
-        print(f"Database initialization error: {e}")
-    finally:
-        conn.close()
+def get_pool_stats():
+    return get_pool().stats()
 
+def to_vector_literal(embedding):
+    """pgvector text input format: '[0.1,0.2,...]'."""
+    return "[" + ",".join(map(str, np.asarray(embedding, dtype=np.float32).tolist())) + "]"
 
+# Schema is managed by migrations.py (run `python migrations.py` before starting the app)
 
 def get_file_metadata(user_id,filename):
     conn = get_connection()    
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT file_oid,id
-        FROM user_storage 
-        WHERE user_id  = %s AND file_name = %s
-        """,
-        (user_id,filename)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        execute_prepared(cursor, PREPARED_STATEMENTS, "file_metadata_by_name", (user_id, filename))
+        result = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
     return {
         "oid": result[0],
         "file_id": result[1]
     } if result else None
 
-def get_file_by_oid(oid):
-    print("Got oid")
-    conn = get_connection()
-    conn.autocommit = False
-    lobj = conn.lobject(oid, 'rb')
-    file_data = lobj.read()
-    lobj.close()
-    conn.close()
-    return BytesIO(file_data)  # Return as file-like object
+class LargeObjectStream:
+    """Chunked reader for a stored file's large object.
+
+    Holds one pooled connection (and its transaction) from construction until close(),
+    so a response can stream the object without loading it into memory.
+    """
+
+    def __init__(self, oid, chunk_size=LOBJECT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._conn = get_connection()
+        try:
+            self._lobj = self._conn.lobject(oid, 'rb')
+            self.size = self._lobj.seek(0, 2)
+        except Exception:
+            self._conn.close()
+            raise
+
+    def iter_range(self, start=0, end=None):
+        """Yield bytes [start, end) in chunk_size pieces."""
+        end = self.size if end is None else min(end, self.size)
+        self._lobj.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = self._lobj.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            if not self._lobj.closed:
+                self._lobj.close()
+        except psycopg2.Error as e:
+            print(f"Error closing large object: {e}")
+        finally:
+            self._conn.close()
+            self._conn = None
 
 # User Operations
 def register_user(username, password):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
@@ -119,9 +166,11 @@ def register_user(username, password):
     except psycopg2.Error as e:
         return False, f"Database error: {e}"
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 def get_user_by_password(password):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
@@ -131,9 +180,11 @@ def get_user_by_password(password):
         print(f"Error getting user by password: {e}")
         return None
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 def get_username(user_id):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
@@ -144,146 +195,777 @@ def get_username(user_id):
         print(f"Error getting username: {e}")
         return None
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 # Chat Operations
-def store_chat_embedding(user_id, newchat_id, message, role, embedding):
+def store_chat_embeddings(rows):
+    """Insert [(user_id, newchat_id, message, role, embedding)] with one multi-row statement."""
+    conn = None
     try:
-        embedding_blob = np.array(embedding, dtype=np.float32).tobytes()
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO chat_history (user_id, newchat_id, embedding, message, role)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user_id, newchat_id, psycopg2.Binary(embedding_blob), message, role))
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO chat_history (user_id, newchat_id, embedding, embedding_codec, message, role)
+            VALUES %s
+        """, [
+            (user_id, newchat_id, psycopg2.Binary(encode(embedding)), EMBEDDING_CODEC, message, role)
+            for user_id, newchat_id, message, role, embedding in rows
+        ])
         conn.commit()
+        return True
     except psycopg2.Error as e:
-        print(f"Error storing chat embedding: {e}")
+        print(f"Error storing chat embeddings: {e}")
+        return False
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+def get_chat_history(user_id, chat_id=None, per_chat_limit=None):
+    """One chat's messages, or {chat_id: messages} for every chat in creation order.
 
-def get_chat_history(user_id, chat_id=None):
+    Without chat_id a single grouped query is used; per_chat_limit keeps only the newest
+    messages of each chat so the cost does not grow with the user's full history.
+    """
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
         if chat_id:
-            cursor.execute("""
-                SELECT message, role FROM chat_history
-                WHERE user_id = %s AND newchat_id = %s
-                ORDER BY id ASC
-            """, (user_id, chat_id))
-        else:
-            cursor.execute("""
-                SELECT DISTINCT newchat_id FROM chat_history
+            execute_prepared(cursor, PREPARED_STATEMENTS, "chat_history_by_chat", (user_id, chat_id))
+            return [{"role": row[1], "content": row[0]} for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT newchat_id,
+                   json_agg(json_build_object('id', id, 'role', role, 'content', message) ORDER BY id)
+            FROM (
+                SELECT id, newchat_id, role, message,
+                       MIN(id) OVER (PARTITION BY newchat_id) AS first_id,
+                       ROW_NUMBER() OVER (PARTITION BY newchat_id ORDER BY id DESC) AS recency
+                FROM chat_history
                 WHERE user_id = %s
-            """, (user_id,))
-            chat_ids = [row[0] for row in cursor.fetchall()]
-            chat_data = {}
-            for cid in chat_ids:
-                cursor.execute("""
-                    SELECT message, role FROM chat_history
-                    WHERE user_id = %s AND newchat_id = %s
-                    ORDER BY id ASC
-                """, (user_id, cid))
-                chat_data[cid] = [{"role": row[1], "content": row[0]} for row in cursor.fetchall()]
-            return chat_data
-        return [{"role": row[1], "content": row[0]} for row in cursor.fetchall()]
+            ) messages
+            WHERE %s::integer IS NULL OR recency <= %s::integer
+            GROUP BY newchat_id
+            ORDER BY MIN(first_id)
+        """, (user_id, per_chat_limit, per_chat_limit))
+        return {row[0]: row[1] for row in cursor.fetchall()}
     except psycopg2.Error as e:
         print(f"Error getting chat history: {e}")
         return None
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+def get_chat_messages(user_id, chat_id, before_id=None, limit=50):
+    """Keyset page of one chat: the `limit` messages older than before_id, oldest first.
+
+    next_before_id is the cursor for the following (older) page, or None at the start of the chat.
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        execute_prepared(cursor, PREPARED_STATEMENTS, "chat_messages_page", (user_id, chat_id, before_id, limit))
+        rows = cursor.fetchall()
+        messages = [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+        next_before_id = messages[0]["id"] if len(rows) == limit else None
+        return {"messages": messages, "next_before_id": next_before_id}
+    except psycopg2.Error as e:
+        print(f"Error getting chat messages: {e}")
+        return {"messages": [], "next_before_id": None}
+    finally:
+        if conn is not None:
+            conn.close()
 
 def get_recent_chat_embeddings(user_id, chat_id, limit=50):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT message, embedding FROM chat_history
-            WHERE user_id = %s AND newchat_id = %s
-            ORDER BY id DESC LIMIT %s
-        """, (user_id, chat_id, limit))
+        execute_prepared(cursor, PREPARED_STATEMENTS, "chat_history_recent", (user_id, chat_id, limit))
         return cursor.fetchall()
     except psycopg2.Error as e:
         print(f"Error getting recent chat embeddings: {e}")
         return []
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 # Document Operations
-def store_document_embedding(user_id, filename, text_snippet, embedding):
+STAGED_CHUNK_COLUMNS = "embedding, embedding_codec, text_snippet, page, chunk_offset, chunk_hash"
+
+class DocumentChunkWriter:
+    """Stage one ingestion job's chunks batch by batch, then swap them in with one short transaction.
+
+    stored maps chunk_hash -> [row_id, ...] for the version already in document_embeddings (rows
+    written before chunk hashes existed are hashed in SQL). The caller matches each batch against
+    it (chunking.match_chunks), embeds the added chunks and passes the result to write(), which
+    commits it to ingestion_chunks on a connection borrowed for that batch only; no transaction or
+    row lock is held while embedding. commit() applies everything staged at once. Only row ids and
+    hashes are held in memory.
+    """
+
+    def __init__(self, job_id, user_id, filename):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.filename = filename
+        self.kept = 0
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            # Rows staged by an earlier attempt of this job (worker died or failed)
+            cursor.execute("DELETE FROM ingestion_chunks WHERE job_id = %s", (job_id,))
+            cursor.execute("""
+                SELECT id, COALESCE(chunk_hash, encode(sha256(convert_to(text_snippet, 'UTF8')), 'hex'))
+                FROM document_embeddings
+                WHERE user_id = %s AND filename = %s
+                ORDER BY id
+            """, (user_id, filename))
+            self.stored = {}
+            for row_id, stored_hash in cursor.fetchall():
+                self.stored.setdefault(stored_hash, []).append(row_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def write(self, kept, added, added_embeddings):
+        """Stage kept rows (with their new page/offset) and the embedded new chunks."""
+        rows = [(self.job_id, row_id, None, EMBEDDING_CODEC, None, chunk.metadata.get("page"),
+                 chunk.metadata.get("start_index"), chunk.metadata["chunk_hash"]) for row_id, chunk in kept]
+        rows += [(self.job_id, None, psycopg2.Binary(encode(embedding)), EMBEDDING_CODEC, chunk.page_content,
+                  chunk.metadata.get("page"), chunk.metadata.get("start_index"), chunk.metadata["chunk_hash"])
+                 for chunk, embedding in zip(added, added_embeddings)]
+        if not rows:
+            return
+        columns, template = f"job_id, row_id, {STAGED_CHUNK_COLUMNS}", None
+        if PGVECTOR_ENABLED:
+            vectors = [None] * len(kept) + [to_vector_literal(embedding) for embedding in added_embeddings]
+            rows = [row + (vector,) for row, vector in zip(rows, vectors)]
+            columns += ", embedding_vec"
+            template = "(%s, %s, %s, %s, %s, %s, %s, %s, %s::vector)"
+        conn = get_connection()
+        try:
+            psycopg2.extras.execute_values(conn.cursor(), f"INSERT INTO ingestion_chunks ({columns}) VALUES %s",
+                                           rows, template=template)
+            conn.commit()
+        finally:
+            conn.close()
+        self.kept += len(kept)
+
+    def commit(self):
+        """Apply the staged chunks if the job is still running.
+
+        Kept rows move to their new page/offset, vanished rows are deleted and new chunks are
+        inserted in one transaction. Returns the number of rows removed, or None (discarding
+        what was staged) when the job was superseded meanwhile (the file was replaced or
+        deleted). The job row, not file_oid, is checked: blobs are content-addressed, so
+        re-uploading an earlier version brings back an earlier job's oid.
+        """
+        columns = STAGED_CHUNK_COLUMNS + (", embedding_vec" if PGVECTOR_ENABLED else "")
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT 1 FROM ingestion_jobs
+                WHERE id = %s AND status = 'running'
+                FOR UPDATE
+            """, (self.job_id,))
+            if cursor.fetchone() is None:
+                cursor.execute("DELETE FROM ingestion_chunks WHERE job_id = %s", (self.job_id,))
+                conn.commit()
+                return None
+            cursor.execute("""
+                UPDATE document_embeddings AS d
+                SET page = s.page, chunk_offset = s.chunk_offset, chunk_hash = s.chunk_hash
+                FROM ingestion_chunks s
+                WHERE s.job_id = %s AND s.row_id = d.id AND d.user_id = %s AND d.filename = %s
+            """, (self.job_id, self.user_id, self.filename))
+            if cursor.rowcount != self.kept:
+                raise psycopg2.DataError("Stored chunks changed during re-embedding")
+            cursor.execute("""
+                DELETE FROM document_embeddings AS d
+                WHERE d.user_id = %s AND d.filename = %s
+                  AND NOT EXISTS (SELECT 1 FROM ingestion_chunks s WHERE s.job_id = %s AND s.row_id = d.id)
+                RETURNING d.id
+            """, (self.user_id, self.filename, self.job_id))
+            removed_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"""
+                INSERT INTO document_embeddings (user_id, filename, {columns})
+                SELECT %s, %s, {columns} FROM ingestion_chunks
+                WHERE job_id = %s AND row_id IS NULL
+                ORDER BY id
+                RETURNING id
+            """, (self.user_id, self.filename, self.job_id))
+            added_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("DELETE FROM ingestion_chunks WHERE job_id = %s", (self.job_id,))
+            conn.commit()
+
+            invalidate_user(self.user_id)
+            record_removed(self.user_id, removed_ids)
+            if ann_index.ANN_INDEX_ENABLED:
+                # Re-read the new vectors in batches rather than holding every embedding until commit
+                for start in range(0, len(added_ids), RECORD_ADDED_BATCH_SIZE):
+                    cursor.execute("""
+                        SELECT id, embedding, embedding_codec FROM document_embeddings
+                        WHERE id = ANY(%s)
+                        ORDER BY id
+                    """, (added_ids[start:start + RECORD_ADDED_BATCH_SIZE],))
+                    rows = cursor.fetchall()
+                    record_added(self.user_id, [row[0] for row in rows], [self.filename] * len(rows),
+                                 decode_many([row[1] for row in rows], [row[2] for row in rows]))
+                conn.commit()
+            ann_index.check(self.user_id, lambda: get_document_fingerprint(self.user_id))
+            return len(removed_ids)
+        finally:
+            conn.close()
+
+    def discard(self):
+        """Drop whatever this job staged (called when it fails)."""
+        conn = get_connection()
+        try:
+            conn.cursor().execute("DELETE FROM ingestion_chunks WHERE job_id = %s", (self.job_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+def get_document_embeddings(user_id):
+    conn = None
     try:
-        embedding_blob = np.array(embedding, dtype=np.float32).tobytes()
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO document_embeddings (user_id, filename, embedding, text_snippet)
-            VALUES (%s, %s, %s, %s)
-        """, (user_id, filename, psycopg2.Binary(embedding_blob), text_snippet))
-        conn.commit()
+        execute_prepared(cursor, PREPARED_STATEMENTS, "document_embeddings_by_user", (user_id,))
+        return cursor.fetchall()
     except psycopg2.Error as e:
-        print(f"Error storing document embedding: {e}")
+        print(f"Error getting document embeddings: {e}")
+        return []
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
-def get_document_embeddings(user_id):
+def get_document_vectors(user_id):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT text_snippet, embedding FROM document_embeddings
+            SELECT id, filename, embedding, embedding_codec FROM document_embeddings
             WHERE user_id = %s
+            ORDER BY id
         """, (user_id,))
         return cursor.fetchall()
     except psycopg2.Error as e:
-        print(f"Error getting document embeddings: {e}")
+        print(f"Error getting document vectors: {e}")
         return []
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
-# File Storage Operations
-def store_file_metadata(user_id, file_name, file_type, file_size, file_path,preview_link):
+def get_document_fingerprint(user_id):
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(MAX(id), 0) FROM document_embeddings
+            WHERE user_id = %s
+        """, (user_id,))
+        return cursor.fetchone()
+    except psycopg2.Error as e:
+        print(f"Error getting document fingerprint: {e}")
+        return (-1, -1)
+    finally:
+        if conn is not None:
+            conn.close()
+
+def query_document_vectors(cursor, user_id, query_vector, top_k):
+    cursor.execute("SET LOCAL hnsw.ef_search = %s", (max(PGVECTOR_EF_SEARCH, top_k),))
+    # The HNSW index is shared by all users and the user filter is applied to what the index
+    # returns; pgvector >= 0.8 can keep scanning until enough rows pass it
+    cursor.execute("SAVEPOINT iterative_scan")
+    try:
+        cursor.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+        cursor.execute("RELEASE SAVEPOINT iterative_scan")
+    except psycopg2.Error:
+        cursor.execute("ROLLBACK TO SAVEPOINT iterative_scan")
+    cursor.execute("""
+        WITH nearest AS MATERIALIZED (
+            SELECT embedding_vec <=> %s::vector AS distance, text_snippet, filename
+            FROM document_embeddings
+            WHERE user_id = %s AND embedding_vec IS NOT NULL
+            ORDER BY embedding_vec <=> %s::vector
+            LIMIT %s
+        )
+        SELECT 1 - distance, text_snippet, filename FROM nearest ORDER BY distance
+    """, (query_vector, user_id, query_vector, top_k))
+    rows = cursor.fetchall()
+    if len(rows) < top_k:
+        # Too few of the index's candidates were this user's (or iterative scans are not
+        # available): rank exactly over the user's own rows, found through the user_id index
+        cursor.execute("""
+            WITH own AS MATERIALIZED (
+                SELECT embedding_vec, text_snippet, filename
+                FROM document_embeddings
+                WHERE user_id = %s AND embedding_vec IS NOT NULL
+            )
+            SELECT 1 - (embedding_vec <=> %s::vector), text_snippet, filename
+            FROM own
+            ORDER BY embedding_vec <=> %s::vector
+            LIMIT %s
+        """, (user_id, query_vector, query_vector, top_k))
+        rows = cursor.fetchall()
+    return [(float(row[0]), row[1], row[2]) for row in rows]
+
+def search_document_vectors(user_id, query_embedding, top_k):
+    """Top-k (score, text, filename) by cosine similarity computed in SQL (pgvector).
+
+    Returns None when the query fails (e.g. the extension or column is missing) so the
+    caller can fall back to the BYTEA path.
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        return query_document_vectors(cursor, user_id, to_vector_literal(query_embedding), top_k)
+    except psycopg2.Error as e:
+        print(f"Error searching document vectors: {e}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+def get_document_snippets(ids):
+    if not ids:
+        return {}
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, text_snippet, filename FROM document_embeddings
+            WHERE id = ANY(%s)
+        """, (list(ids),))
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        print(f"Error getting document snippets: {e}")
+        return {}
+    finally:
+        if conn is not None:
+            conn.close()
+
+# Embedding Cache Operations
+def get_cached_embeddings(cache_keys, touch_after_seconds=3600):
+    """{cache_key: blob} for the keys found; hits not used within touch_after_seconds get last_used_at bumped."""
+    if not cache_keys:
+        return {}
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT cache_key, embedding FROM embedding_cache
+            WHERE cache_key = ANY(%s)
+        """, (list(cache_keys),))
+        found = {row[0]: bytes(row[1]) for row in cursor.fetchall()}
+        if found:
+            cursor.execute("""
+                UPDATE embedding_cache SET last_used_at = NOW()
+                WHERE cache_key = ANY(%s) AND last_used_at < NOW() - make_interval(secs => %s)
+            """, (list(found), touch_after_seconds))
+            conn.commit()
+        return found
+    except psycopg2.Error as e:
+        print(f"Error getting cached embeddings: {e}")
+        return {}
+    finally:
+        if conn is not None:
+            conn.close()
+
+def store_cached_embeddings(rows):
+    if not rows:
+        return
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO embedding_cache (cache_key, model, embedding)
+            VALUES %s
+            ON CONFLICT (cache_key) DO UPDATE SET last_used_at = NOW()
+        """, [(key, model, psycopg2.Binary(blob)) for key, model, blob in rows])
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error storing cached embeddings: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+def prune_embedding_cache(max_age_days, max_rows, batch_size=5000):
+    """Delete cached embeddings unused for max_age_days, then the least recently used beyond max_rows.
+
+    Deletes in batches of batch_size so no run holds long locks; returns the number of rows removed.
+    """
+    removed = 0
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT SUM(file_size) FROM user_storage WHERE user_id = %s", (user_id,))
-        current_used_space = cursor.fetchone()[0] or 0
-        new_used_space = current_used_space + file_size
+        while True:
+            cursor.execute("""
+                DELETE FROM embedding_cache
+                WHERE cache_key IN (
+                    SELECT cache_key FROM embedding_cache
+                    WHERE last_used_at < NOW() - make_interval(days => %s)
+                    LIMIT %s
+                )
+            """, (max_age_days, batch_size))
+            conn.commit()
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        while True:
+            cursor.execute("""
+                DELETE FROM embedding_cache
+                WHERE cache_key IN (
+                    SELECT cache_key FROM embedding_cache
+                    ORDER BY last_used_at DESC
+                    OFFSET %s LIMIT %s
+                )
+            """, (max_rows, batch_size))
+            conn.commit()
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        return removed
+    except psycopg2.Error as e:
+        print(f"Error pruning embedding cache: {e}")
+        return removed
+    finally:
+        if conn is not None:
+            conn.close()
+
+# File Storage Operations
+def _release_blobs(cursor, content_hashes):
+    """Drop one reference per hash; blobs left without references are unlinked by collect_file_blobs."""
+    content_hashes = [content_hash for content_hash in content_hashes if content_hash is not None]
+    for content_hash in content_hashes:
+        cursor.execute("""
+            UPDATE file_blobs
+            SET ref_count = ref_count - 1,
+                released_at = CASE WHEN ref_count = 1 THEN NOW() ELSE released_at END
+            WHERE content_hash = %s
+        """, (content_hash,))
+
+def _lock_usage(cursor, user_id):
+    """Lock the user's usage counter row until commit/rollback (creating it if needed); returns used bytes."""
+    cursor.execute("""
+        INSERT INTO user_storage_usage (user_id, used_bytes) VALUES (%s, 0)
+        ON CONFLICT (user_id) DO NOTHING
+    """, (user_id,))
+    cursor.execute("SELECT used_bytes FROM user_storage_usage WHERE user_id = %s FOR UPDATE", (user_id,))
+    return cursor.fetchone()[0]
+
+def _release_usage(cursor, user_id, size):
+    if size:
+        cursor.execute("""
+            UPDATE user_storage_usage SET used_bytes = used_bytes - %s, updated_at = NOW()
+            WHERE user_id = %s
+        """, (size, user_id))
+
+class FileUploadTransaction:
+    """One connection and transaction for all files of an upload request.
+
+    Large objects are written while the request body is being read; nothing (including
+    the removal of files being replaced) is visible to other sessions until commit().
+    """
+
+    def __init__(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self._deleted = []
+        self._added = []
+
+    def lock_usage(self, user_id):
+        """Used bytes of the user, locked so concurrent uploads and deletes wait for this commit."""
+        return _lock_usage(self.cursor, user_id)
+
+    def existing_files(self, user_id):
+        """{file_name: file_size} as seen by this transaction."""
+        self.cursor.execute("SELECT file_name, file_size FROM user_storage WHERE user_id = %s", (user_id,))
+        return {row[0]: row[1] for row in self.cursor.fetchall()}
+
+    def delete_existing(self, user_id, file_name, keep_chunks=False):
+        """Remove the stored version of file_name.
+
+        With keep_chunks the old chunks stay until the re-ingestion job diffs the new
+        version against them (see DocumentChunkWriter), so unchanged chunks are not re-embedded;
+        they are deleted if that job fails (see _drop_unreplaced_chunks).
+        """
+        self.cursor.execute("""
+            DELETE FROM user_storage
+            WHERE user_id = %s AND file_name = %s
+            RETURNING content_hash, file_size
+        """, (user_id, file_name))
+        removed = self.cursor.fetchall()
+        _release_blobs(self.cursor, [row[0] for row in removed])
+        _release_usage(self.cursor, user_id, sum(row[1] or 0 for row in removed))
+        # Queued work for the replaced version must not store chunks for the new one
+        self.cursor.execute("""
+            UPDATE ingestion_jobs SET status = 'superseded', stage = 'superseded', finished_at = NOW()
+            WHERE user_id = %s AND file_name = %s AND status IN ('queued', 'running')
+        """, (user_id, file_name))
+        if keep_chunks:
+            return
+        self.cursor.execute("""
+            DELETE FROM document_embeddings
+            WHERE user_id = %s AND filename = %s
+        """, (user_id, file_name))
+        self._deleted.append((user_id, file_name))
+
+    def begin_file(self):
+        self.cursor.execute("SAVEPOINT upload_file")
+
+    def discard_file(self):
+        """Undo everything since begin_file() (including the large object written for it)."""
+        self.cursor.execute("ROLLBACK TO SAVEPOINT upload_file")
+
+    def find_content(self, user_id, content_hash):
+        """{file_name: (has_chunks, ingestion_pending)} for the user's files with this content."""
+        self.cursor.execute("""
+            SELECT s.file_name,
+                   EXISTS (SELECT 1 FROM document_embeddings d
+                           WHERE d.user_id = s.user_id AND d.filename = s.file_name),
+                   EXISTS (SELECT 1 FROM ingestion_jobs j
+                           WHERE j.user_id = s.user_id AND j.file_name = s.file_name AND j.file_oid = s.file_oid
+                             AND j.status IN ('queued', 'running'))
+            FROM user_storage s
+            WHERE s.user_id = %s AND s.content_hash = %s
+        """, (user_id, content_hash))
+        return {row[0]: (row[1], row[2]) for row in self.cursor.fetchall()}
+
+    def copy_chunks(self, user_id, source_file, file_name):
+        """Reattach another file's chunks and embeddings to file_name; returns the number copied."""
+        columns = "embedding, embedding_codec, text_snippet, page, chunk_offset, chunk_hash"
+        if PGVECTOR_ENABLED:
+            columns += ", embedding_vec"
+        self.cursor.execute(f"""
+            INSERT INTO document_embeddings (user_id, filename, {columns})
+            SELECT user_id, %s, {columns} FROM document_embeddings
+            WHERE user_id = %s AND filename = %s
+            ORDER BY id
+            RETURNING id, embedding, embedding_codec
+        """, (file_name, user_id, source_file))
+        rows = self.cursor.fetchall()
+        if rows:
+            self._added.append((user_id, file_name, rows))
+        return len(rows)
+
+    def new_large_object(self):
+        self.cursor.execute("SELECT lo_create(0)")
+        return self.conn.lobject(self.cursor.fetchone()[0], 'wb')  # 'wb' = write binary mode
+
+    def add_file(self, user_id, file_name, file_type, file_size, preview_link, lobj, content_hash):
+        """Store the file's row, pointing at the shared blob for its content; returns the blob's oid.
+
+        When the content is already stored (for any user) the object just written is unlinked
+        again and the file only adds a reference to the existing one.
+        """
+        lobj.close()
+        self.cursor.execute("""
+            INSERT INTO file_blobs (content_hash, oid, size, ref_count)
+            VALUES (%s, %s, %s, 1)
+            ON CONFLICT (content_hash) DO UPDATE
+            SET ref_count = file_blobs.ref_count + 1, released_at = NULL
+            RETURNING oid
+        """, (content_hash, lobj.oid, file_size))
+        oid = self.cursor.fetchone()[0]
+        if oid != lobj.oid:
+            self.cursor.execute("SELECT lo_unlink(%s)", (lobj.oid,))
+        self.cursor.execute("""
+            UPDATE user_storage_usage SET used_bytes = used_bytes + %s, updated_at = NOW()
+            WHERE user_id = %s
+            RETURNING used_bytes
+        """, (file_size, user_id))
+        new_used_space = self.cursor.fetchone()[0]
         ist = pytz.timezone('Asia/Kolkata')
         ist_time = datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S')
+        self.cursor.execute("""
+            INSERT INTO user_storage (user_id, file_name, file_type, file_size, uploaded_at, used_space, file_path,file_oid,
+                                      content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (user_id, file_name, file_type, file_size, ist_time, new_used_space, preview_link, oid, content_hash))
+        return oid
 
-        cursor.execute("SELECT lo_create(0)")
-        oid = cursor.fetchone()[0]
-
-        lobj = conn.lobject(oid, 'wb')  # 'wb' = write binary mode
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(4096)  # Read in 4KB chunks (adjust as needed)
-                if not chunk:
-                    break
-                lobj.write(chunk)
-            print("File read")
-        lobj.close()
+    def enqueue_ingestion(self, batch_id, user_id, file_name, file_type, oid):
+        self.cursor.execute("""
+            INSERT INTO ingestion_jobs (batch_id, user_id, file_name, file_type, file_oid)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (batch_id, user_id, file_name, file_type, oid))
+
+    def commit(self):
+        self.conn.commit()
+        for user_id, file_name in self._deleted:
+            invalidate_user(user_id)
+            record_file_deleted(user_id, file_name)
+        for user_id, file_name, rows in self._added:
+            invalidate_user(user_id)
+            record_added(user_id, [row[0] for row in rows], [file_name] * len(rows),
+                         decode_many([row[1] for row in rows], [row[2] for row in rows]))
+        for user_id in {user_id for user_id, _ in self._deleted} | {user_id for user_id, _, _ in self._added}:
+            ann_index.check(user_id, lambda: get_document_fingerprint(user_id))
+        self._deleted = []
+        self._added = []
 
+    def close(self):
+        """Roll back anything not committed and return the connection to the pool."""
+        self.conn.close()
+
+# Ingestion Job Operations
+INGESTION_JOB_COLUMNS = ("id", "batch_id", "user_id", "file_name", "file_type", "file_oid", "status", "stage",
+                         "chunks_total", "chunks_done", "chunks_reused", "attempts", "error")
+
+def claim_ingestion_job():
+    """Mark the oldest queued job running and return it; SKIP LOCKED lets workers claim in parallel."""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE ingestion_jobs
+            SET status = 'running', stage = 'starting', attempts = attempts + 1,
+                started_at = NOW(), heartbeat_at = NOW(), error = NULL
+            WHERE id = (
+                SELECT id FROM ingestion_jobs
+                WHERE status = 'queued'
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {", ".join(INGESTION_JOB_COLUMNS)}
+        """)
+        row = cursor.fetchone()
+        conn.commit()
+        return dict(zip(INGESTION_JOB_COLUMNS, row)) if row else None
+    except psycopg2.Error as e:
+        print(f"Error claiming ingestion job: {e}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _drop_unreplaced_chunks(cursor, job_ids):
+    """Delete the chunks left for failed jobs to replace; returns {(user_id, filename)} affected.
+
+    A re-upload keeps the previous version's chunks until its job swaps in the new ones (see
+    FileUploadTransaction.delete_existing). If that job fails for good they would keep answering
+    for a file they no longer describe. job_ids are jobs the caller has just moved from running
+    to failed in this transaction: a job superseded by a later upload is never among them (that
+    upload owns the file's chunks), and the job row lock orders this against such an upload.
+    """
+    cursor.execute("DELETE FROM ingestion_chunks WHERE job_id = ANY(%s)", (job_ids,))
+    cursor.execute("""
+        DELETE FROM document_embeddings AS d
+        USING ingestion_jobs j
+        WHERE j.id = ANY(%s) AND j.status = 'failed' AND d.user_id = j.user_id AND d.filename = j.file_name
+        RETURNING d.user_id, d.filename
+    """, (job_ids,))
+    return set(cursor.fetchall())
+
+def _chunks_dropped(files):
+    for user_id, filename in files:
+        print(f"Removed the previous chunks of {filename} (user {user_id}) after its ingestion failed")
+        invalidate_user(user_id)
+        record_file_deleted(user_id, filename)
+        ann_index.check(user_id, lambda: get_document_fingerprint(user_id))
+
+def update_ingestion_job(job_id, status=None, stage=None, chunks_total=None, chunks_done=None, chunks_reused=None,
+                         error=None):
+    """Record progress (also the worker's heartbeat); unset fields keep their value."""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO user_storage (user_id, file_name, file_type, file_size, uploaded_at, used_space, file_path,file_oid)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (user_id, file_name, file_type, file_size, ist_time, new_used_space,preview_link,oid))
+            UPDATE ingestion_jobs
+            SET status = COALESCE(%s, status),
+                stage = COALESCE(%s, stage),
+                chunks_total = COALESCE(%s, chunks_total),
+                chunks_done = COALESCE(%s, chunks_done),
+                chunks_reused = COALESCE(%s, chunks_reused),
+                error = COALESCE(%s, error),
+                heartbeat_at = NOW(),
+                finished_at = CASE WHEN %s IN ('done', 'failed', 'superseded') THEN NOW() ELSE finished_at END
+            WHERE id = %s AND status <> 'superseded'
+              AND (%s::text IS DISTINCT FROM 'failed' OR status = 'running')
+        """, (status, stage, chunks_total, chunks_done, chunks_reused, error, status, job_id, status))
+        dropped = _drop_unreplaced_chunks(cursor, [job_id]) if status == "failed" and cursor.rowcount else set()
         conn.commit()
+        _chunks_dropped(dropped)
     except psycopg2.Error as e:
-        print(f"Error storing file metadata: {e}")
+        print(f"Error updating ingestion job: {e}")
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
-def get_user_files(user_id):
+def requeue_stale_ingestion_jobs(stale_seconds, max_attempts):
+    """Return running jobs without a recent heartbeat to the queue (or fail them after max_attempts)."""
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT file_name, file_type, uploaded_at, file_path,id
-            FROM user_storage
-            WHERE user_id = %s
-        """, (user_id,))
+            UPDATE ingestion_jobs
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                error = CASE WHEN attempts >= %s THEN 'Worker stopped responding' ELSE error END,
+                finished_at = CASE WHEN attempts >= %s THEN NOW() ELSE NULL END
+            WHERE status = 'running' AND heartbeat_at < NOW() - make_interval(secs => %s)
+            RETURNING id, status
+        """, (max_attempts, max_attempts, max_attempts, stale_seconds))
+        jobs = cursor.fetchall()
+        dropped = _drop_unreplaced_chunks(cursor, [job_id for job_id, status in jobs if status == "failed"])
+        # Staged rows of jobs that finished without cleaning up (superseded while their worker died)
+        cursor.execute("""
+            DELETE FROM ingestion_chunks c
+            USING ingestion_jobs j
+            WHERE c.job_id = j.id AND j.status IN ('done', 'failed', 'superseded')
+              AND j.finished_at < NOW() - make_interval(secs => %s)
+        """, (stale_seconds,))
+        conn.commit()
+        _chunks_dropped(dropped)
+        return len(jobs)
+    except psycopg2.Error as e:
+        print(f"Error requeueing ingestion jobs: {e}")
+        return 0
+    finally:
+        if conn is not None:
+            conn.close()
+
+def get_ingestion_jobs(user_id, batch_id):
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {", ".join(INGESTION_JOB_COLUMNS)},
+                   ROUND((chunks_done / NULLIF(EXTRACT(EPOCH FROM COALESCE(finished_at, heartbeat_at) - started_at), 0))
+                         ::numeric, 1)::float8
+            FROM ingestion_jobs
+            WHERE user_id = %s AND batch_id = %s
+            ORDER BY id
+        """, (user_id, batch_id))
+        return [dict(zip(INGESTION_JOB_COLUMNS + ("chunks_per_second",), row)) for row in cursor.fetchall()]
+    except psycopg2.Error as e:
+        print(f"Error getting ingestion jobs: {e}")
+        return []
+    finally:
+        if conn is not None:
+            conn.close()
+
+def get_user_files(user_id):
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        execute_prepared(cursor, PREPARED_STATEMENTS, "user_files_by_user", (user_id,))
         return [{
             "file_name": row[0],
             "file_type": row[1],
@@ -295,58 +977,122 @@ def get_user_files(user_id):
         print(f"Error getting user files: {e}")
         return []
     finally:
-        conn.close()
-
-def get_existing_files(user_id):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT file_name, file_size FROM user_storage
-            WHERE user_id = %s
-        """, (user_id,))
-        return {row[0]: row[1] for row in cursor.fetchall()}
-    except psycopg2.Error as e:
-        print(f"Error getting existing files: {e}")
-        return {}
-    finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 def delete_file(user_id, file_name):
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
+        _lock_usage(cursor, user_id)
         cursor.execute("""
             DELETE FROM user_storage
             WHERE user_id = %s AND file_name = %s
+            RETURNING content_hash, file_size
         """, (user_id, file_name))
+        removed = cursor.fetchall()
+        _release_blobs(cursor, [row[0] for row in removed])
+        _release_usage(cursor, user_id, sum(row[1] or 0 for row in removed))
         cursor.execute("""
             DELETE FROM document_embeddings
             WHERE user_id = %s AND filename = %s
         """, (user_id, file_name))
         conn.commit()
+        invalidate_user(user_id)
+        record_file_deleted(user_id, file_name)
+        ann_index.check(user_id, lambda: get_document_fingerprint(user_id))
         return True
     except psycopg2.Error as e:
         print(f"Error deleting file: {e}")
         return False
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+def collect_file_blobs(grace_seconds, batch_size=500):
+    """Unlink large objects nothing refers to any more; returns (objects, bytes) reclaimed.
 
-def get_used_storage(user_id):
+    Blobs whose last reference was dropped more than grace_seconds ago are unlinked, as are
+    objects that never got a file_blobs row (left behind by deletes before blobs were
+    content-addressed). Only one collector runs at a time across processes.
+    """
+    conn = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (BLOB_GC_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            return (0, 0)
+        # SKIP LOCKED: a blob an upload is re-referencing right now is left for the next run
         cursor.execute("""
-            SELECT SUM(file_size) FROM user_storage
-            WHERE user_id = %s
-        """, (user_id,))
-        result = cursor.fetchone()
-        return result[0] or 0
+            DELETE FROM file_blobs
+            WHERE content_hash IN (
+                SELECT content_hash FROM file_blobs
+                WHERE ref_count <= 0 AND released_at < NOW() - make_interval(secs => %s)
+                ORDER BY released_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING oid, size
+        """, (grace_seconds, batch_size))
+        released = cursor.fetchall()
+        cursor.execute("""
+            SELECT m.oid, lo_lseek64(lo_open(m.oid, 262144), 0, 2)  -- 262144 = INV_READ, 2 = SEEK_END
+            FROM pg_largeobject_metadata m
+            WHERE NOT EXISTS (SELECT 1 FROM file_blobs b WHERE b.oid = m.oid)
+              AND NOT EXISTS (SELECT 1 FROM user_storage s WHERE s.file_oid = m.oid)
+              AND NOT EXISTS (SELECT 1 FROM ingestion_jobs j
+                              WHERE j.file_oid = m.oid AND j.status IN ('queued', 'running'))
+            LIMIT %s
+        """, (batch_size,))
+        orphaned = cursor.fetchall()
+        unlinked = released + orphaned
+        if unlinked:
+            cursor.execute("SELECT lo_unlink(oid) FROM unnest(%s::oid[]) AS oid", ([row[0] for row in unlinked],))
+        conn.commit()
+        return (len(unlinked), sum(row[1] or 0 for row in unlinked))
     except psycopg2.Error as e:
-        print(f"Error getting used storage: {e}")
-        return 0
+        print(f"Error collecting file blobs: {e}")
+        return (0, 0)
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+def reconcile_storage_usage():
+    """Compare every usage counter with the SUM(file_size) it stands for and repair drift.
+
+    Drift is found with one consistent read; each drifted counter is then locked and set from a
+    fresh sum, so uploads committing meanwhile are not overwritten. Returns [(user_id, counted, actual)].
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(u.user_id, s.user_id), u.used_bytes, COALESCE(s.used, 0)
+            FROM user_storage_usage u
+            FULL JOIN (SELECT user_id, SUM(file_size) AS used FROM user_storage GROUP BY user_id) s
+                ON s.user_id = u.user_id
+            WHERE u.used_bytes IS DISTINCT FROM COALESCE(s.used, 0)
+        """)
+        corrections = []
+        for user_id, _, _ in cursor.fetchall():
+            counted = _lock_usage(cursor, user_id)
+            cursor.execute("SELECT COALESCE(SUM(file_size), 0) FROM user_storage WHERE user_id = %s", (user_id,))
+            actual = cursor.fetchone()[0]
+            if counted != actual:
+                cursor.execute("""
+                    UPDATE user_storage_usage SET used_bytes = %s, updated_at = NOW()
+                    WHERE user_id = %s
+                """, (actual, user_id))
+                corrections.append((user_id, counted, actual))
+            conn.commit()
+        return corrections
+    except psycopg2.Error as e:
+        print(f"Error reconciling storage usage: {e}")
+        return []
+    finally:
+        if conn is not None:
+            conn.close()
 
-# Initialize DB
-init_db()
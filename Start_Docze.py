@@ -22,7 +22,16 @@ PYTHON_PATH = os.getenv('PYTHON_PATH', 'python')
 #     print(e)
 #     exit(1)
 
-# Step 2: Launch Flask backend
+# Step 2: Apply pending database migrations
+print("🗄️ Applying database migrations...")
+try:
+    subprocess.run([PYTHON_PATH, "migrations.py"], check=True)
+except subprocess.CalledProcessError as e:
+    print("❌ Database migration failed.")
+    print(e)
+    exit(1)
+
+# Step 3: Launch Flask backend
 print("🚀 Starting Flask backend...")
 flask_process = subprocess.Popen(
     [PYTHON_PATH, FLASK_PATH],
@@ -30,18 +39,18 @@ flask_process = subprocess.Popen(
     stderr=subprocess.PIPE,
 )
 
-# Step 3: Wait for Flask to be ready
+# Step 4: Wait for Flask to be ready
 time.sleep(20)
 
-# Step 4: Launch Streamlit frontend
+# Step 5: Launch Streamlit frontend
 print("🚀 Launching Streamlit frontend...")
 streamlit_process = subprocess.Popen([PYTHON_PATH, "-m", "streamlit", "run", STREAMLIT_PATH])
 
-# Step 5: Optional: open Streamlit in browser
+# Step 6: Optional: open Streamlit in browser
 time.sleep(8)
 webbrowser.open("https://localhost:8501")
 
-# Step 6: Keep the launcher alive
+# Step 7: Keep the launcher alive
 try:
     flask_process.wait()
     streamlit_process.wait()
@@ -52,7 +61,7 @@ except KeyboardInterrupt:
     flask_process.terminate()
     streamlit_process.terminate()
 
-   # Step 7: Gracefully stop Docker containers (without removing volumes/images)
+   # Step 8: Gracefully stop Docker containers (without removing volumes/images)
     # print("🧹 Stopping Docker containers...")
     # subprocess.run(["docker-compose", "stop"])
 
@@ -0,0 +1,358 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from embedding_codec import decode_many
+
+# Approximate nearest-neighbour mode (IVF-flat) for large per-user corpora
+ANN_INDEX_ENABLED = os.getenv("ANN_INDEX", "0") == "1"
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "ann_indexes")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 8))
+ANN_MIN_TRAIN_ROWS = int(os.getenv("ANN_MIN_TRAIN_ROWS", 1024))  # below this every search is exact
+ANN_PERSIST_DELAY = float(os.getenv("ANN_PERSIST_DELAY", 5.0))  # seconds of quiet before saving
+ANN_MAX_LOADED_BYTES = int(os.getenv("ANN_MAX_LOADED_BYTES", 512 * 1024 * 1024))
+KMEANS_ITERATIONS = 10
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def train_centroids(vectors, nlist, seed=0):
+    """Spherical k-means over (a sample of) normalized vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * 256)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists so every centroid stays useful
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    """Inverted-file index with exact (flat) scoring inside the probed lists."""
+
+    def __init__(self, dim=0):
+        self.dim = dim
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.trained_rows = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.filenames = np.empty(0, dtype=str)
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.assignments = np.empty(0, dtype=np.int32)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.ids.nbytes + self.filenames.nbytes + self.centroids.nbytes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _assign(self, vectors):
+        if len(self.centroids) == 0:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train(self):
+        count = len(self.ids)
+        if count < ANN_MIN_TRAIN_ROWS:
+            self.centroids = np.empty((0, self.dim), dtype=np.float32)
+        else:
+            nlist = int(min(1024, max(1, np.sqrt(count))))
+            self.centroids = train_centroids(self.vectors, nlist)
+        self.trained_rows = count
+        self.assignments = self._assign(self.vectors)
+
+    def needs_training(self):
+        count = len(self.ids)
+        if count >= ANN_MIN_TRAIN_ROWS and len(self.centroids) == 0:
+            return True
+        return self.trained_rows and count > 4 * self.trained_rows
+
+    def add(self, ids, filenames, embeddings):
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+        if len(self.ids) == 0:
+            self.dim = vectors.shape[1]
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            self.centroids = np.empty((0, self.dim), dtype=np.float32)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.filenames = np.concatenate([self.filenames, np.asarray(filenames, dtype=str)])
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+        if self.needs_training():
+            self.train()
+
+    def remove_file(self, filename):
+        self._keep(self.filenames != filename)
+
+    def remove_ids(self, ids):
+        self._keep(~np.isin(self.ids, np.asarray(ids, dtype=np.int64)))
+
+    def _keep(self, keep):
+        self.ids = self.ids[keep]
+        self.filenames = self.filenames[keep]
+        self.vectors = self.vectors[keep]
+        self.assignments = self.assignments[keep]
+
+    def search(self, query_embedding, top_k=1, nprobe=ANN_NPROBE):
+        """Return [(score, row_id)] best first, scanning only the nprobe closest lists."""
+        if len(self.ids) == 0 or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if len(self.centroids) > nprobe:
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.flatnonzero(np.isin(self.assignments, probes))
+        else:
+            candidates = np.arange(len(self.ids))
+        scores = self.vectors[candidates] @ query
+        if top_k < len(candidates):
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(float(scores[i]), int(self.ids[candidates[i]])) for i in best]
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, trained_rows=self.trained_rows, ids=self.ids,
+                 filenames=self.filenames, vectors=self.vectors, assignments=self.assignments)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data["vectors"].shape[1])
+            index.centroids = data["centroids"]
+            index.trained_rows = int(data["trained_rows"])
+            index.ids = data["ids"]
+            index.filenames = data["filenames"]
+            index.vectors = data["vectors"]
+            index.assignments = data["assignments"]
+        return index
+
+    @classmethod
+    def build(cls, rows):
+        """Build from (id, filename, embedding_blob[, embedding_codec]) rows."""
+        index = cls()
+        if rows:
+            embeddings = decode_many([row[2] for row in rows], [row[3] if len(row) > 3 else None for row in rows])
+            index.add([row[0] for row in rows], [row[1] for row in rows], embeddings)
+        return index
+
+
+_indexes = OrderedDict()
+_locks = {}
+_save_timers = {}
+_registry_lock = threading.Lock()
+
+
+def index_path(user_id):
+    return os.path.join(ANN_INDEX_DIR, f"user_{user_id}.npz")
+
+
+def _user_lock(user_id):
+    with _registry_lock:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def _remember(user_id, index):
+    with _registry_lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        total = sum(loaded.nbytes for loaded in _indexes.values())
+        while total > ANN_MAX_LOADED_BYTES and len(_indexes) > 1:
+            evicted_user, evicted = _indexes.popitem(last=False)
+            total -= evicted.nbytes
+            if evicted_user in _save_timers:
+                # Persist pending changes before dropping the in-memory copy
+                _save_timers.pop(evicted_user).cancel()
+                evicted.save(index_path(evicted_user))
+
+
+def _schedule_save(user_id):
+    def save():
+        with _user_lock(user_id):
+            with _registry_lock:
+                _save_timers.pop(user_id, None)
+                index = _indexes.get(user_id)
+            if index is not None:
+                os.makedirs(ANN_INDEX_DIR, exist_ok=True)
+                index.save(index_path(user_id))
+
+    with _registry_lock:
+        if user_id in _save_timers:
+            _save_timers[user_id].cancel()
+        timer = threading.Timer(ANN_PERSIST_DELAY, save)
+        timer.daemon = True
+        _save_timers[user_id] = timer
+    timer.start()
+
+
+def _matches(index, fingerprint):
+    """Whether index holds as many rows as fingerprint (row_count, max_row_id) and the same newest id."""
+    count, max_id = fingerprint
+    return len(index) == count and (count == 0 or int(index.ids.max()) == max_id)
+
+
+def _forget(user_id):
+    """Drop the user's index from memory and disk; the next get_index() rebuilds it."""
+    with _registry_lock:
+        _indexes.pop(user_id, None)
+        timer = _save_timers.pop(user_id, None)
+    if timer is not None:
+        timer.cancel()
+    try:
+        os.remove(index_path(user_id))
+    except FileNotFoundError:
+        pass
+
+
+def _loaded_index(user_id):
+    with _registry_lock:
+        index = _indexes.get(user_id)
+    if index is None and os.path.exists(index_path(user_id)):
+        index = IVFFlatIndex.load(index_path(user_id))
+        _remember(user_id, index)
+    return index
+
+
+def get_index(user_id, loader, fingerprint):
+    """Return the user's index, loading it from disk or building it from loader() rows.
+
+    fingerprint() must return (row_count, max_row_id) for the user's document_embeddings.
+    It is checked on every call, so an index (in memory or persisted) that missed a change,
+    e.g. one made by another process, is rebuilt before it is searched.
+    """
+    with _user_lock(user_id):
+        expected = fingerprint()
+        with _registry_lock:
+            index = _indexes.get(user_id)
+            if index is not None:
+                _indexes.move_to_end(user_id)
+        if index is not None and _matches(index, expected):
+            return index
+        path = index_path(user_id)
+        if index is None and os.path.exists(path):
+            index = IVFFlatIndex.load(path)
+            if _matches(index, expected):
+                _remember(user_id, index)
+                return index
+        index = IVFFlatIndex.build(loader())
+        _remember(user_id, index)
+        os.makedirs(ANN_INDEX_DIR, exist_ok=True)
+        index.save(path)
+        return index
+
+
+def record_added(user_id, ids, filenames, embeddings):
+    """Apply newly inserted document_embeddings rows to a loaded or persisted index."""
+    with _user_lock(user_id):
+        index = _loaded_index(user_id)
+        if index is None:
+            return
+        index.add(ids, filenames, embeddings)
+    _schedule_save(user_id)
+
+
+def record_file_deleted(user_id, filename):
+    """Drop a deleted file's rows from a loaded or persisted index."""
+    with _user_lock(user_id):
+        index = _loaded_index(user_id)
+        if index is None:
+            return
+        index.remove_file(filename)
+    _schedule_save(user_id)
+
+
+def record_removed(user_id, ids):
+    """Drop individual rows (chunks that vanished from a re-uploaded file)."""
+    if not ids:
+        return
+    with _user_lock(user_id):
+        index = _loaded_index(user_id)
+        if index is None:
+            return
+        index.remove_ids(ids)
+    _schedule_save(user_id)
+
+
+def check(user_id, fingerprint):
+    """Drop the user's loaded index if it does not match fingerprint() (see get_index).
+
+    Called after a committed change has been applied with the record_* functions: a persisted
+    index they loaded may already have been stale, and another writer may have got in between.
+    """
+    with _user_lock(user_id):
+        with _registry_lock:
+            index = _indexes.get(user_id)
+        if index is not None and not _matches(index, fingerprint()):
+            print(f"ANN index of user {user_id} is out of date; it will be rebuilt")
+            _forget(user_id)
+
+
+def flush():
+    """Persist every index with pending changes (called on shutdown)."""
+    with _registry_lock:
+        pending = list(_save_timers.items())
+        _save_timers.clear()
+    for user_id, timer in pending:
+        timer.cancel()
+        with _user_lock(user_id):
+            index = _indexes.get(user_id)
+            if index is not None:
+                os.makedirs(ANN_INDEX_DIR, exist_ok=True)
+                index.save(index_path(user_id))
+
+
+# Recall / latency benchmark against the exact scan: python ann_index.py [rows] [dim]
+def benchmark(rows=20000, dim=1536, queries=100, top_k=10, clusters=200, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    corpus = centers[rng.integers(clusters, size=rows)] + 1.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+    probes = corpus[rng.choice(rows, queries, replace=False)] + 0.5 * rng.normal(size=(queries, dim)).astype(np.float32)
+
+    started = time.perf_counter()
+    index = IVFFlatIndex()
+    index.add(np.arange(rows), ["bench"] * rows, corpus)
+    build_seconds = time.perf_counter() - started
+
+    exact_matrix = _normalize(corpus)
+    exact_seconds = 0.0
+    exact_results = []
+    for query in probes:
+        started = time.perf_counter()
+        scores = exact_matrix @ (query / np.linalg.norm(query))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        exact_seconds += time.perf_counter() - started
+        exact_results.append(set(best.tolist()))
+
+    print(f"rows={rows} dim={dim} lists={len(index.centroids)} build={build_seconds:.2f}s")
+    print(f"exact scan: {1000 * exact_seconds / queries:.2f} ms/query")
+    for nprobe in (1, 4, ANN_NPROBE, 16, 32):
+        ann_seconds = 0.0
+        hits = 0
+        for query, expected in zip(probes, exact_results):
+            started = time.perf_counter()
+            found = index.search(query, top_k, nprobe=nprobe)
+            ann_seconds += time.perf_counter() - started
+            hits += len(expected & {row_id for _, row_id in found})
+        print(f"ivf nprobe={nprobe:<3} {1000 * ann_seconds / queries:.2f} ms/query  "
+              f"recall@{top_k}={hits / (queries * top_k):.3f}")
+
+
+if __name__ == "__main__":
+    benchmark(*[int(arg) for arg in sys.argv[1:3]])
@@ -2,39 +2,69 @@ import os
 import jwt as pyjwt
 from datetime import datetime, timedelta
 import openai
-import re
-import numpy as np
-import requests
-from flask import Flask, request, jsonify, send_from_directory,send_file
+import json
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+import psycopg2
+import mimetypes
+from urllib.parse import quote
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader
-from sklearn.metrics.pairwise import cosine_similarity
 from context_manager import generate_reply_template
-from docx import Document as DocxDocument
-from langchain.schema import Document
+from similarity_engine import get_user_corpus, top_matches
+import ann_index
+from chunking import iter_chunks, iter_batches, match_chunks
+from context_assembler import assemble_context
+from embedding_cache import CachedEmbeddings, EMBEDDING_CACHE_PERSIST, EMBEDDING_CACHE_MAX_AGE_DAYS, EMBEDDING_CACHE_MAX_ROWS
+from chat_writer import ChatWriteBehind
+import system_info
+from system_info import get_system_information, FALLBACK_SYSTEM_INFO
+from query_rewriter import QueryRewriter
+from stage_executor import Stage, run_stages
+from upload_stream import SpooledUpload, QuotaExceeded, copy_upload
+from pdf_extraction import iter_pdf_pages
+from docx_extraction import iter_docx_sections
+from txt_extraction import iter_text_blocks
+import pdf_extraction
 import hashlib
+from ingestion_queue import IngestionWorkerPool, JobSuperseded, batch_status, INGESTION_STAGES
+from blob_gc import BlobCollector
+from storage_usage import UsageReconciler
+import uuid
+from langchain.schema import Document
 import pytz
+import atexit
+import time
 
 # from SQLite_database import (
 from Postgres import (
-    init_db,
     register_user,
     get_user_by_password,
     get_username,
-    store_chat_embedding,
+    store_chat_embeddings,
     get_chat_history,
+    get_chat_messages,
     get_recent_chat_embeddings,
-    store_document_embedding,
+    DocumentChunkWriter,
     get_document_embeddings,
-    store_file_metadata,
+    get_document_vectors,
+    get_document_fingerprint,
+    get_document_snippets,
+    search_document_vectors,
+    PGVECTOR_ENABLED,
+    FileUploadTransaction,
+    claim_ingestion_job,
+    update_ingestion_job,
+    requeue_stale_ingestion_jobs,
+    collect_file_blobs,
+    reconcile_storage_usage,
+    get_ingestion_jobs,
     get_user_files,
-    get_existing_files,
-    delete_file,
-    get_used_storage,
     get_file_metadata, 
-    get_file_by_oid
+    LargeObjectStream,
+    get_cached_embeddings,
+    store_cached_embeddings,
+    get_pool_stats,
+    prune_embedding_cache
 )
  
 # Load OpenAI API Key
@@ -49,40 +79,82 @@ app = Flask(__name__)
 #                    async_mode='threading')
 SECRET_KEY = "your_secret_key"
  
+# Resolve the server location once in the background; requests read the cached value
+system_info.start()
+ 
+# Persist pending ANN index updates on shutdown
+atexit.register(ann_index.flush)
+ 
 # Initialize Embedding Model
-embeddings_model = OpenAIEmbeddings(model="text-embedding-ada-002")
+EMBEDDING_MODEL = "text-embedding-ada-002"
+persist_embeddings = EMBEDDING_CACHE_PERSIST == "postgres"
+embeddings_model = CachedEmbeddings(
+    OpenAIEmbeddings(model=EMBEDDING_MODEL),
+    EMBEDDING_MODEL,
+    persistent_get=get_cached_embeddings if persist_embeddings else None,
+    persistent_put=store_cached_embeddings if persist_embeddings else None,
+)
 # Initialize AI Model
 chat_model = ChatOpenAI(model="gpt-4o-mini")
+# Chat turns are embedded and stored in the background; flushed on shutdown
+chat_writer = ChatWriteBehind(embeddings_model, store_chat_embeddings)
+atexit.register(chat_writer.close)
+ 
+# LLM fallbacks for questions the local rewriter cannot resolve confidently
+def llm_rewrite_question(last_message, question):
+    return chat_model.invoke(
+        f"I will give you a message and a question containing pronouns. Rewrite the question by replacing pronouns with the correct entity from the message.\n\nMessage: \"{last_message}\"\nQuestion: \"{question}\"\nRewritten Question:").content
  
-# List of pronouns to track
-PRONOUNS = {"he", "she", "his", "her", "him", "hers", "they", "them", "their", "theirs",
-            "it", "its", "here", "there", "this", "that", "these", "those"}
-USER_PRONOUNS = {"me", "my", "mine", "myself"}
+def llm_about_user(question):
+    return chat_model.invoke(
+        f"Sentence:{question},RETURN ONLY BOOLEAN ,Determine if a given sentence is asking about the user themselves, If the sentence is about the user , return false. Otherwise, return true.").content
+ 
+query_rewriter = QueryRewriter(llm_rewrite_question, llm_about_user)
  
 # Resolve Pronouns
 def resolve_pronouns(question, chat_history):
     try:
-        if not chat_history:
-            return chat_history, question, "true"
- 
-        last_message = chat_history[0]
-        words = set(re.findall(r'\b\w+\b', question.lower()))
- 
-        if words & PRONOUNS:
-            modified_question = chat_model.invoke(
-                f"I will give you a message and a question containing pronouns. Rewrite the question by replacing pronouns with the correct entity from the message.\n\nMessage: \"{last_message}\"\nQuestion: \"{question}\"\nRewritten Question:").content
-            return [last_message], modified_question, "true"
- 
-        if words & USER_PRONOUNS:
-            chat_response = chat_model.invoke(
-                f"Sentence:{question},RETURN ONLY BOOLEAN ,Determine if a given sentence is asking about the user themselves, If the sentence is about the user , return false. Otherwise, return true.").content
-            # return chat_history, question, chat_response
- 
-        return chat_history, question, chat_response
+        return query_rewriter.resolve(question, chat_history)
     except Exception as e:
         print(f"Error resolving pronouns: {e}")
         return chat_history, question, "true"
  
+# Chat reads that also see turns still queued in chat_writer
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 50))  # messages per page of one chat
+DEFAULT_CHAT_ID = "chat_1"
+# (snapshot() keeps a batch that commits during the read from showing up twice)
+def get_recent_chat_rows(user_id, chat_id, limit=50):
+    stored, pending = chat_writer.snapshot(lambda: get_recent_chat_embeddings(user_id, chat_id, limit),
+                                           lambda: chat_writer.pending(user_id, chat_id))
+    pending = [(turn.message, None, None) for turn in reversed(pending)]
+    return (pending + stored)[:limit]
+ 
+def get_chat_history_with_pending(user_id, per_chat_limit=None):
+    chat_data, pending = chat_writer.snapshot(lambda: get_chat_history(user_id, per_chat_limit=per_chat_limit),
+                                              lambda: chat_writer.pending_chats(user_id))
+    chat_data = chat_data or {}
+    for chat_id, turns in pending.items():
+        messages = chat_data.setdefault(chat_id, [])
+        messages.extend({"role": turn.role, "content": turn.message} for turn in turns)
+        if per_chat_limit:
+            chat_data[chat_id] = messages[-per_chat_limit:]
+    return chat_data
+ 
+def get_chat_page_with_pending(user_id, chat_id, before_id=None, limit=CHAT_PAGE_SIZE):
+    if before_id is not None:
+        return get_chat_messages(user_id, chat_id, before_id, limit)
+    # The newest page also shows turns that are still queued for writing
+    page, pending = chat_writer.snapshot(lambda: get_chat_messages(user_id, chat_id, before_id, limit),
+                                         lambda: chat_writer.pending(user_id, chat_id))
+    pending = [{"role": turn.role, "content": turn.message} for turn in pending]
+    messages = page["messages"] + pending
+    dropped = [message for message in messages[:-limit] if "id" in message]
+    if dropped:
+        # Stored rows pushed off this page by queued turns start the next (older) page
+        page["next_before_id"] = dropped[-1]["id"] + 1
+    page["messages"] = messages[-limit:]
+    return page
+ 
 # JWT Authentication
 def generate_token(user_id):
     try:
@@ -109,92 +181,174 @@ def allowed_file(filename):
     ALLOWED_EXTENSIONS = {"pdf", "docx", "txt"}
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text(file_path, file_extension):
+def extract_text(upload, file_extension, content_hash=None):
+    """Pages of a SpooledUpload as Documents (PDF pages carry a 0-based "page").
+
+    PDF pages, DOCX sections and TXT blocks are produced lazily by pdf_extraction,
+    docx_extraction and txt_extraction; errors while reading them surface to the caller
+    instead of being swallowed here.
+    """
     try:
         if file_extension == "pdf":
-            loader = PyMuPDFLoader(file_path)
-            return loader.load()
+            if upload.path is not None:
+                source = upload.path
+            else:
+                with upload.open() as f:
+                    source = f.read()
+            return (Document(page_content=text, metadata={"page": number})
+                    for number, text in iter_pdf_pages(source, content_hash))
 
         elif file_extension == "docx":
-            doc = DocxDocument(file_path)
-            extracted_text = "\n".join([para.text for para in doc.paragraphs])
-            return [Document(page_content=extracted_text)]
+            # Paragraphs and table cells are streamed out of word/document.xml in sections;
+            # "offset" places each section (and its joining newline) in the document's text
+            source = upload.path if upload.path is not None else upload.open()
+            def read_sections():
+                offset = 0
+                for text in iter_docx_sections(source):
+                    yield Document(page_content=text + "\n", metadata={"offset": offset})
+                    offset += len(text) + 1
+            return read_sections()
 
         elif file_extension == "txt":
-            with open(file_path, "r", encoding="utf-8") as file:
-                extracted_text = file.read()
-            return [Document(page_content=extracted_text)]
+            # Read in blocks ending on line boundaries; "offset" places the block's chunks in the file
+            def read_blocks():
+                with upload.open() as f:
+                    for offset, text in iter_text_blocks(f):
+                        yield Document(page_content=text, metadata={"offset": offset})
+            return read_blocks()
 
     except Exception as e:
         print(f"Error extracting text from file: {e}")
         return []
 
  
-def compute_file_hash(file_path):
+# Background ingestion: uploaded files are extracted, chunked, embedded and stored by a worker pool
+def ingest_file(job, progress):
+    user_id, file_name = job["user_id"], job["file_name"]
+    spool = SpooledUpload(suffix=f".{job['file_type']}")
+    hasher = hashlib.sha256()
     try:
-        hasher = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
-        return hasher.hexdigest()
-    except Exception as e:
-        print(f"Error computing file hash: {e}")
-        return None
+        progress(stage="reading")
+        stream = LargeObjectStream(job["file_oid"])
+        try:
+            for block in stream.iter_range():
+                hasher.update(block)
+                spool.write(block)
+        finally:
+            stream.close()
+        spool.finish()
+
+        # Chunks stream through in embedding-sized batches: each batch is matched against the
+        # previous version by content hash, only new text is embedded (outside any transaction)
+        # and the batch is staged straight away, so memory does not grow with the file
+        progress(stage="embedding", chunks_total=None, chunks_done=0, chunks_reused=0)
+        started = time.perf_counter()
+        writer = DocumentChunkWriter(job["id"], user_id, file_name)
+        try:
+            done = 0
+            chunks = iter_chunks(extract_text(spool, job["file_type"], hasher.hexdigest()))
+            for batch in iter_batches(chunks):
+                kept, added = match_chunks(batch, writer.stored)
+                added_embeddings = (embeddings_model.embed_documents([chunk.page_content for chunk in added])
+                                    if added else [])
+                writer.write(kept, added, added_embeddings)
+                done += len(batch)
+                progress(chunks_done=done, chunks_reused=writer.kept)
+
+            progress(stage="storing")
+            removed = writer.commit()
+        except Exception:
+            writer.discard()
+            raise
+        if removed is None:
+            raise JobSuperseded()
+        elapsed = time.perf_counter() - started
+        print(f"Ingested {file_name}: {done} chunks ({writer.kept} reused, {removed} removed) "
+              f"in {elapsed:.1f}s, {done / elapsed if elapsed else 0:.1f} chunks/s")
+        return {"chunks_total": done, "chunks_reused": writer.kept}
+    finally:
+        spool.close()
+ 
+# Registered first so it runs after the ingestion workers have stopped
+atexit.register(pdf_extraction.shutdown)
+ingestion_pool = IngestionWorkerPool(ingest_file, claim_ingestion_job, update_ingestion_job,
+                                     requeue_stale_ingestion_jobs)
+atexit.register(ingestion_pool.close)
+blob_collector = BlobCollector(
+    collect_file_blobs,
+    prune=(lambda: prune_embedding_cache(EMBEDDING_CACHE_MAX_AGE_DAYS, EMBEDDING_CACHE_MAX_ROWS))
+    if persist_embeddings else None,
+)
+atexit.register(blob_collector.close)
+usage_reconciler = UsageReconciler(reconcile_storage_usage)
+atexit.register(usage_reconciler.close)
  
 MAX_USER_STORAGE = 30 * 1024 * 1024  # 30MB limit
+CONTEXT_DOC_CANDIDATES = int(os.getenv("CONTEXT_DOC_CANDIDATES", 20))  # passages offered to the context budget
  
 def retrieve_similar_context(user_id, newchat_id, query, top_k=1):
-    def get_top_matches(data):
-        similarities = []
-        query_embedding = embeddings_model.embed_query(query)
-        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-        for text, embedding_blob in data:
-            stored_embedding = np.frombuffer(embedding_blob, dtype=np.float32).reshape(1, -1)
-            similarity = cosine_similarity(query_vector, stored_embedding)[0][0]
-            similarities.append((similarity, text))
-        similarities.sort(reverse=True, key=lambda x: x[0])
-        return [text for _, text in similarities[:top_k]]
- 
-    chat_data = get_recent_chat_embeddings(user_id, newchat_id)
-    chat_history = [row[0] for row in chat_data]
-    relevant_chat_history, modified_query, chat_response = resolve_pronouns(query, chat_history)
-    doc_context = ''
-    meta_context = ''
-    top_match = ''
+    def get_top_matches(corpus, query_embedding):
+        return top_matches(corpus, query_embedding, CONTEXT_DOC_CANDIDATES)
+
+    def get_ann_matches(query_embedding):
+        index = ann_index.get_index(user_id, lambda: get_document_vectors(user_id),
+                                    lambda: get_document_fingerprint(user_id))
+        matches = index.search(query_embedding, CONTEXT_DOC_CANDIDATES)
+        snippets = get_document_snippets([row_id for _, row_id in matches])
+        return [(score, *snippets[row_id]) for score, row_id in matches if row_id in snippets]
+ 
+    def get_doc_matches(query_embedding):
+        if PGVECTOR_ENABLED:
+            matches = search_document_vectors(user_id, query_embedding, CONTEXT_DOC_CANDIDATES)
+            if matches is not None:
+                return matches
+        if ann_index.ANN_INDEX_ENABLED:
+            return get_ann_matches(query_embedding)
+        doc_corpus = get_user_corpus(user_id, lambda: get_document_embeddings(user_id),
+                                     lambda: get_document_fingerprint(user_id))
+        return get_top_matches(doc_corpus, query_embedding)
+ 
+    # Independent stages run concurrently; documents and files are fetched speculatively
+    # and dropped below if the question turns out to be about the user
+    run = run_stages([
+        Stage("chat_history", lambda: get_recent_chat_rows(user_id, newchat_id), default=[]),
+        Stage("query_embedding", lambda: embeddings_model.embed_query(query)),
+        Stage("rewrite", lambda rows: resolve_pronouns(query, [row[0] for row in rows]), deps=("chat_history",)),
+        Stage("documents", get_doc_matches, deps=("query_embedding",), default=[]),
+        Stage("file_metadata", lambda: get_user_files(user_id), default=[]),
+        Stage("location", get_system_information, default=FALLBACK_SYSTEM_INFO),
+    ])
+    chat_data = run["chat_history"]
+    relevant_chat_history, modified_query, chat_response = run["rewrite"] or ([row[0] for row in chat_data], query, "true")
+    # resolve_pronouns keeps either the whole history or only its newest message
+    chat_rows = chat_data[:len(relevant_chat_history)]
+    query_embedding = run["query_embedding"]
+    doc_matches = []
+    meta_context = []
    
     if (chat_response.lower() == "true"):
-        doc_data = get_document_embeddings(user_id)
-        top_match = get_top_matches(doc_data)
-        doc_context = "\n".join([row[0] for row in doc_data])
-        meta_data = get_user_files(user_id)
-        meta_context = [{"name": row["file_name"], "doc_preview_link": row["file_path"]} for row in meta_data]
- 
-    def get_system_location():
-        try:
-            response = requests.get("http://ip-api.com/json/")
-            data = response.json()
-            location_info = {
-                "Country": data.get("country"),
-                "Region": data.get("regionName"),
-                "City": data.get("city"),
-                "Latitude": data.get("lat"),
-                "Longitude": data.get("lon"),
-                "ISP": data.get("isp"),
-                "IP Address": data.get("query")
-            }
-            return location_info
-        except Exception as e:
-            return {"error": str(e)}
+        doc_matches = run["documents"]
+        meta_context = [{"name": row["file_name"], "doc_preview_link": row["file_path"]} for row in run["file_metadata"]]
+
+    context = assemble_context(query_embedding, chat_rows, doc_matches, meta_context)
+    top_match = [text for _, text, _ in doc_matches[:top_k]]
  
-    location_data = get_system_location()
     context_template = generate_reply_template(
-        previous_conversations=relevant_chat_history,
-        other_information=doc_context,
-        system_information=location_data,
-        doc_metadata=meta_context
+        previous_conversations=context.chat_history,
+        other_information=context.other_information,
+        system_information=run["location"],
+        doc_metadata=context.file_metadata
     )
+    report = {"context_tokens": context.token_report(), "timings": run.report(),
+              "embedding_cache": embeddings_model.stats(), "query_rewriter": query_rewriter.stats(),
+              "db_pool": get_pool_stats()}
    
-    return top_match, context_template, modified_query
+    return top_match, context_template, modified_query, report
+ 
+def build_ask_prompt(user_id, newchat_id, question):
+    relevant_docs, context_template, mdfy_question, report = retrieve_similar_context(user_id, newchat_id, question)
+    prompt = f"{context_template}\nRelevant Docs: {relevant_docs}\n\nUser Query: {mdfy_question}"
+    return prompt, report
  
 # @app.route("/preview/<id>/<filename>")
 # def preview_file(filename, id):
@@ -207,40 +361,61 @@ def retrieve_similar_context(user_id, newchat_id, query, top_k=1):
 #     UPLOAD_FOLDER = f"temp/{id}"
 #     app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 #     return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=True)
+def send_large_object(oid, filename, mimetype, as_attachment):
+    """Stream a stored file from its large object, honouring single Range requests."""
+    try:
+        stream = LargeObjectStream(oid)
+    except psycopg2.Error as e:
+        print(f"Error opening large object {oid}: {e}")
+        return "File not found", 404
+    size = stream.size
+    etag = f"{oid}-{size}"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"{'attachment' if as_attachment else 'inline'}; filename*=UTF-8''{quote(filename)}",
+    }
+    status, start, end = 200, 0, size
+    byte_range = request.range
+    # If-Range: only serve a partial response when the client's copy is still current
+    if_range = request.if_range
+    range_valid = if_range.date is None and if_range.etag in (None, etag)
+    if byte_range is not None and range_valid:
+        bounds = byte_range.range_for_length(size)
+        if bounds is not None:
+            status, (start, end) = 206, bounds
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        elif len(byte_range.ranges) == 1 and byte_range.units == "bytes":
+            stream.close()
+            return Response(status=416, headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"})
+        # Multiple ranges are answered with the whole file
+    headers["Content-Length"] = str(end - start)
+    response = Response(stream.iter_range(start, end), status=status, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+    response.set_etag(etag)
+    # Runs when the server is done with the response (also for HEAD and aborted downloads)
+    response.call_on_close(stream.close)
+    return response
+
 @app.route("/preview/<user_id>/<filename>")
 def preview_file(user_id, filename):
-    print("preview file")
     # Verify metadata matches request
     metadata = get_file_metadata(user_id,filename)
     if not metadata :
         return "File not found", 404
-    file_stream = get_file_by_oid(metadata["oid"])
     mimetype = 'application/pdf'
     if filename.lower().endswith(('.docx')):
        mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-
-    #     mimetype = f'image/{filename.split(".")[-1]}'
-    # print("download file")
-    return send_file(
-        file_stream,
-        mimetype=mimetype,
-        as_attachment=False  # Preview in browser
-    )
+    elif filename.lower().endswith('.txt'):
+       mimetype = 'text/plain'
+    return send_large_object(metadata["oid"], filename, mimetype, as_attachment=False)  # Preview in browser
 
 @app.route("/download/<user_id>/<filename>")
 def download_file(user_id, filename):
-    print("Download file")
     metadata = get_file_metadata(user_id,filename)
     if not metadata :
         return "File not found", 404
-    
-    file_stream = get_file_by_oid(metadata["oid"])
-    
-    return send_file(
-        file_stream,
-        as_attachment=True,
-        download_name=filename  # Force save with original name
-    )
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return send_large_object(metadata["oid"], filename, mimetype, as_attachment=True)  # Force save with original name
  
 @app.route("/get_user_details", methods=["GET"])
 def get_user_details():
@@ -299,8 +474,8 @@ def login():
         if user_name != username:
             return jsonify({"error": "Invalid username (or) password"}), 404
        
-        chat_history = get_chat_history(user_id)
-        chat_history = [{"role": row["role"], "content": row["content"]} for row in chat_history.get(1, [])][-50:]  # Get most recent 50 messages from default chat
+        page = get_chat_page_with_pending(user_id, DEFAULT_CHAT_ID)  # Most recent messages from default chat
+        chat_history = [{"role": row["role"], "content": row["content"]} for row in page["messages"]]
  
         token = generate_token(user_id)
         return jsonify({
@@ -325,74 +500,85 @@ def upload_documents():
         return jsonify({"error": "No files uploaded"}), 400
    
     uploaded_files = request.files.getlist("files")
+    for file in uploaded_files:
+        if file.filename == "" or not allowed_file(file.filename):
+            return jsonify({
+                "error": f"❗🥲 Invalid file format: {file.filename}🙆🏻‍♂️"
+            }), 400
  
+    transaction = None
     try:
-        current_used_space = get_used_storage(user_id)
-        existing_files = get_existing_files(user_id)
-        updated_files = []
+        transaction = FileUploadTransaction()
+        # Held until commit: a concurrent upload or delete of this user waits instead of racing the quota
+        current_used_space = transaction.lock_usage(user_id)
+        existing_files = transaction.existing_files(user_id)
+        replacing = list(dict.fromkeys(file.filename for file in uploaded_files if file.filename in existing_files))
+        # Replaced files no longer count against the quota
+        remaining_space = MAX_USER_STORAGE - current_used_space + sum(existing_files[name] or 0 for name in replacing)
         total_files = 0
         file_hashes = set()
-        temp_folder = os.path.join("temp", str(user_id))
-        os.makedirs(temp_folder, exist_ok=True)
+        updated_files = []
+        unchanged_files = []
+        skipped_stages = {}
+        jobs_enqueued = 0
  
+        # Single pass per file: hash, quota check and large-object write together
+        batch_id = uuid.uuid4().hex
         for file in uploaded_files:
             file_name = file.filename
-            file_contents = file.read()
- 
-            if file_name == "" or not allowed_file(file_name):
+            file_extension = file_name.rsplit(".", 1)[1].lower()
+            transaction.begin_file()
+            lobj = transaction.new_large_object()
+            try:
+                file_hash, file_size = copy_upload(file.stream, [lobj.write], remaining_space)
+            except QuotaExceeded:
                 return jsonify({
-                    "error": f"❗🥲 Invalid file format: {file_name}🙆🏻‍♂️"
+                    "error": "❗🥲 Storage limit exceeded🗄️ (30MB)"
                 }), 400
- 
-            file_extension = file_name.rsplit(".", 1)[1].lower()
-            file_path = os.path.join(temp_folder, file_name)
- 
-            if file_name in existing_files:
-                os.remove(file_path)
-                delete_file(user_id, file_name)
-                updated_files.append(file_name)
- 
-            with open(file_path, "wb") as f:
-                f.write(file_contents)
- 
             total_files += 1
-            file_size = os.path.getsize(file_path)
-            file_hash = compute_file_hash(file_path)
  
             if file_hash in file_hashes:
-                os.remove(file_path)
                 return jsonify({
                     "error": f"❗🥲 Duplicate file detected: {file_name}. Remove duplicates from the list."
                 }), 400
- 
-            if current_used_space + file_size > MAX_USER_STORAGE:
-                os.remove(file_path)
-                return jsonify({
-                    "error": "❗🥲 Storage limit exceeded🗄️ (30MB)"
-                }), 400
- 
             file_hashes.add(file_hash)
- 
-        for file in uploaded_files:
-            file_name = file.filename
-            file_contents = file.read()
-            file_extension = file_name.rsplit(".", 1)[1].lower()
-            file_path = os.path.join(temp_folder, file_name)
-            file_size = os.path.getsize(file_path)
- 
-            extracted_text = extract_text(file_path, file_extension)
-            chat_response = chat_model.invoke(f"Text format of single resume doc:{extracted_text},##Format this resume without bullet points and **,##Don't give any extra text or ** or any highlighting string in response").content
-            doc = Document(page_content=chat_response)
- 
-            if file_name.lower().endswith(".pdf"):
-                preview_link = f"https://docz-fzuo.onrender.com/preview/{user_id}/{file_name}"
-                # preview_link = f"http://localhost:5000/preview/{user_id}/{file_name}"
-            elif file_name.lower().endswith(".docx"):
+            remaining_space -= file_size
+ 
+            # {file_name: (has_chunks, ingestion_pending)} of stored files with identical content
+            copies = transaction.find_content(user_id, file_hash)
+            if any(copies.get(file_name, (False, False))):
+                # Identical re-upload of a processed (or processing) file: keep the stored version
+                lobj.close()
+                transaction.discard_file()
+                unchanged_files.append(file_name)
+                skipped_stages[file_name] = list(INGESTION_STAGES)
+                continue
+ 
+            # Same content already processed under another name: reuse its text and embeddings
+            source = next((name for name, (has_chunks, pending) in copies.items()
+                           if has_chunks and not pending and name != file_name), None)
+            if file_name in existing_files:
+                # A re-ingested update keeps its old chunks so only changed ones are embedded again
+                transaction.delete_existing(user_id, file_name, keep_chunks=source is None)
+                updated_files.append(file_name)
+            if file_extension == "docx":
                 preview_link = f"https://docs.google.com/viewerng/viewer?url=https://docz-fzuo.onrender.com/preview/{user_id}/{file_name}&embedded=true"
                 # preview_link = f"http://localhost:5000/download/{user_id}/{file_name}"
- 
-            store_file_metadata(user_id, file_name, file_extension, file_size, file_path,preview_link)
-            store_document_embedding(user_id, file_name, doc.page_content, embeddings_model.embed_query(doc.page_content))
+            else:
+                preview_link = f"https://docz-fzuo.onrender.com/preview/{user_id}/{file_name}"
+                # preview_link = f"http://localhost:5000/preview/{user_id}/{file_name}"
+            oid = transaction.add_file(user_id, file_name, file_extension, file_size, preview_link, lobj, file_hash)
+ 
+            if source and transaction.copy_chunks(user_id, source, file_name):
+                skipped_stages[file_name] = ["extract", "chunk", "embed"]
+                continue
+            # Extraction, chunking and embedding run on the ingestion workers
+            transaction.enqueue_ingestion(batch_id, user_id, file_name, file_extension, oid)
+            jobs_enqueued += 1
+            skipped_stages[file_name] = []
+        transaction.commit()
+        if jobs_enqueued:
+            ingestion_pool.notify()
  
         if total_files == 1:
             info_msg = "1 file uploaded successfully👍🏻"
@@ -401,17 +587,49 @@ def upload_documents():
  
         if len(updated_files) == total_files:
             if len(updated_files) == 1:
-                return jsonify({"message":"One file updated successfully 😉","files_updated":updated_files}),200
+                message = "One file updated successfully 😉"
             else:
-                return jsonify({"message":f"{len(updated_files)} files updated successfully 😉","files_updated":updated_files}),200
+                message = f"{len(updated_files)} files updated successfully 😉"
         elif len(updated_files) == 1:
-            return jsonify({"message":f"{info_msg} and {len(updated_files)} file updated 😉","files_updated":updated_files}),200
+            message = f"{info_msg} and {len(updated_files)} file updated 😉"
         elif len(updated_files) != 0:
-            return jsonify({"message":f"{info_msg} and {len(updated_files)} files updated 😉","files_updated":updated_files}),200
+            message = f"{info_msg} and {len(updated_files)} files updated 😉"
         else:
-           return jsonify({"message":info_msg}),200
+            message = info_msg
+        if unchanged_files and len(unchanged_files) == total_files:
+            message = "Files are unchanged, nothing to process 😉"
+        response = {"message": message, "skipped_stages": skipped_stages}
+        if updated_files:
+            response["files_updated"] = updated_files
+        if unchanged_files:
+            response["files_unchanged"] = unchanged_files
+        if jobs_enqueued:
+            response["job_id"] = batch_id
+        return jsonify(response), 202 if jobs_enqueued else 200
     except Exception as e:
         return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+    finally:
+        # Rolls back anything not committed
+        if transaction is not None:
+            transaction.close()
+ 
+@app.route("/ingestion_status/<job_id>", methods=["GET"])
+def ingestion_status(job_id):
+    token = request.headers.get("Authorization")
+    if not token:
+        return jsonify({"error": "Missing token"}), 401
+ 
+    user_id = verify_token(token)
+    if not user_id:
+        return jsonify({"error": "Invalid or expired token"}), 401
+ 
+    jobs = get_ingestion_jobs(user_id, job_id)
+    if not jobs:
+        return jsonify({"error": "Job not found"}), 404
+    files = [{key: job[key] for key in ("file_name", "status", "stage", "chunks_total", "chunks_done",
+                                        "chunks_reused", "chunks_per_second", "error")}
+             for job in jobs]
+    return jsonify({"job_id": job_id, "status": batch_status(jobs), "files": files}), 200
  
 @app.route("/ask", methods=["POST"])
 def ask():
@@ -430,18 +648,67 @@ def ask():
         if not question:
             return jsonify({"error": "Question is required"}), 400
        
-        relevant_docs, context_template, mdfy_question = retrieve_similar_context(user_id, newchat_id, question)
-        chat_response = chat_model.invoke(f"{context_template}\nRelevant Docs: {relevant_docs}\n\nUser Query: {mdfy_question}").content
+        prompt, report = build_ask_prompt(user_id, newchat_id, question)
+        chat_response = chat_model.invoke(prompt).content
        
-        # Store both user question and AI response
-        store_chat_embedding(user_id, newchat_id, question, "user", embeddings_model.embed_query(question))
-        store_chat_embedding(user_id, newchat_id, chat_response, "assistant", embeddings_model.embed_query(chat_response))
+        # Store both user question and AI response (embedded and inserted in the background)
+        chat_writer.submit(user_id, newchat_id, [(question, "user"), (chat_response, "assistant")])
        
-        return jsonify({"answer": chat_response})
+        return jsonify({"answer": chat_response, **report})
     except Exception as e:
         print(f"Error in /ask route: {e}")
         return jsonify({"error": "An error occurred while processing your request"}), 500
  
+@app.route("/ask_stream", methods=["POST"])
+def ask_stream():
+    try:
+        token = request.headers.get("Authorization")
+        if not token:
+            return jsonify({"error": "Missing token"}), 401
+   
+        user_id = verify_token(token)
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+   
+        data = request.get_json()
+        question = data.get("question")
+        newchat_id = data.get("chatid")
+        if not question:
+            return jsonify({"error": "Question is required"}), 400
+       
+        prompt, report = build_ask_prompt(user_id, newchat_id, question)
+    except Exception as e:
+        print(f"Error in /ask_stream route: {e}")
+        return jsonify({"error": "An error occurred while processing your request"}), 500
+ 
+    def generate():
+        parts = []
+        try:
+            for chunk in chat_model.stream(prompt):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            print(f"Error while streaming /ask_stream response: {e}")
+            yield "\n\n⚠️ The response was interrupted. Please try again."
+            return
+        # Persist only complete answers, once the stream has finished
+        chat_writer.submit(user_id, newchat_id, [(question, "user"), ("".join(parts), "assistant")])
+ 
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/plain",
+        headers={
+            "X-Context-Tokens": json.dumps(report["context_tokens"]),
+            "X-Stage-Timings": json.dumps(report["timings"]),
+            "X-Embedding-Cache": json.dumps(report["embedding_cache"]),
+            "X-Query-Rewriter": json.dumps(report["query_rewriter"]),
+            "X-DB-Pool": json.dumps(report["db_pool"]),
+            "X-Accel-Buffering": "no",  # ask proxies not to buffer the stream
+            "Cache-Control": "no-cache",
+        },
+    )
+ 
 @app.route("/get_chat_history", methods=["GET"])
 def get_chat_history_route():
     try:
@@ -453,7 +720,18 @@ def get_chat_history_route():
         if not user_id:
             return jsonify({"error": "Invalid or expired token"}), 401
  
-        chat_data = get_chat_history(user_id)
+        chat_id = request.args.get("chat_id")
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = max(1, min(limit, 500))
+        if chat_id:
+            limit = limit or CHAT_PAGE_SIZE
+            before_id = request.args.get("before_id", type=int)
+            page = get_chat_page_with_pending(user_id, chat_id, before_id, limit)
+            return jsonify({"chat_history": page["messages"], "next_before_id": page["next_before_id"]}), 200
+
+        # Every chat in full unless the caller asks for only the newest `limit` messages of each
+        chat_data = get_chat_history_with_pending(user_id, per_chat_limit=limit)
         return jsonify({"chat_history": chat_data}), 200
     except Exception as e:
         print(f"Error in /get_chat_history route: {e}")
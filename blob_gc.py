@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+
+# Collection of large objects no file refers to any more (see file_blobs)
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", 3600))  # seconds between collection runs
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", 3600))  # released blobs kept for re-uploads
+
+
+def collect_all(collect, grace_seconds=BLOB_GC_GRACE_SECONDS, stopped=None):
+    """Call collect(grace_seconds) -> (objects, bytes) until a run reclaims nothing; returns the totals."""
+    objects_total, bytes_total = 0, 0
+    while stopped is None or not stopped.is_set():
+        objects, reclaimed = collect(grace_seconds)
+        if not objects:
+            break
+        objects_total += objects
+        bytes_total += reclaimed
+    return objects_total, bytes_total
+
+
+class BlobCollector:
+    """Background thread that runs collect_all() every interval and logs the reclaimed bytes.
+
+    prune, if given, is called after each collection for other storage that only needs
+    periodic trimming (the persistent embedding cache) and returns the number of rows removed.
+    """
+
+    def __init__(self, collect, interval=BLOB_GC_INTERVAL, grace_seconds=BLOB_GC_GRACE_SECONDS, prune=None):
+        self.collect = collect
+        self.prune = prune
+        self.interval = interval
+        self.grace_seconds = grace_seconds
+        self.reclaimed_objects = 0
+        self.reclaimed_bytes = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="blob-gc", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        objects, reclaimed = collect_all(self.collect, self.grace_seconds, self._stopped)
+        if objects:
+            self.reclaimed_objects += objects
+            self.reclaimed_bytes += reclaimed
+            print(f"Reclaimed {objects} large objects ({reclaimed / 2**20:.1f} MiB)")
+        if self.prune is not None:
+            pruned = self.prune()
+            if pruned:
+                print(f"Pruned {pruned} cached embeddings")
+        return objects, reclaimed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error collecting large objects: {e}")
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(5.0)
+
+
+# One-off collection: python blob_gc.py [grace seconds]
+if __name__ == "__main__":
+    from Postgres import collect_file_blobs
+
+    grace = float(sys.argv[1]) if len(sys.argv) > 1 else BLOB_GC_GRACE_SECONDS
+    objects, reclaimed = collect_all(collect_file_blobs, grace)
+    print(f"Reclaimed {objects} large objects ({reclaimed / 2**20:.1f} MiB)")
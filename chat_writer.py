@@ -0,0 +1,176 @@
+import os
+import time
+import queue
+import threading
+import itertools
+
+# Write-behind settings for chat turn persistence
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", 64))  # turns per embed + insert
+CHAT_WRITE_MAX_WAIT = float(os.getenv("CHAT_WRITE_MAX_WAIT", 0.2))  # seconds to gather a batch
+CHAT_WRITE_RETRIES = int(os.getenv("CHAT_WRITE_RETRIES", 3))  # attempts at shutdown before unsaved turns are dropped
+CHAT_WRITE_RETRY_DELAY = float(os.getenv("CHAT_WRITE_RETRY_DELAY", 0.25))  # first backoff, doubled per failure
+CHAT_WRITE_MAX_DELAY = float(os.getenv("CHAT_WRITE_MAX_DELAY", 30.0))
+
+
+class PendingTurn:
+    __slots__ = ("seq", "user_id", "chat_id", "message", "role", "embedding")
+
+    def __init__(self, seq, user_id, chat_id, message, role):
+        self.seq = seq
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message = message
+        self.role = role
+        self.embedding = None
+
+
+class ChatWriteBehind:
+    """Background pipeline that embeds chat turns in batches and stores them in one insert.
+
+    store_rows receives [(user_id, newchat_id, message, role, embedding)], must write them
+    in a single statement and return True on success (see Postgres.store_chat_embeddings).
+    Turns stay visible through pending() until their batch has been committed; a batch that
+    cannot be written is retried in place with exponential backoff, so no later turn is stored
+    before it (chat history is read back in id order). Turns are only dropped at shutdown.
+    """
+
+    def __init__(self, embeddings_model, store_rows, batch_size=CHAT_WRITE_BATCH_SIZE,
+                 max_wait=CHAT_WRITE_MAX_WAIT):
+        self.embeddings_model = embeddings_model
+        self.store_rows = store_rows
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Odd while a batch is being committed and forgotten; see snapshot()
+        self._version = 0
+        self._version_changed = threading.Condition(self._lock)
+        self._failures = 0
+        self._seq = itertools.count()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, chat_id, turns):
+        """Queue [(message, role), ...] for persistence; returns immediately."""
+        entries = [PendingTurn(next(self._seq), user_id, chat_id, message, role) for message, role in turns]
+        with self._lock:
+            self._pending.setdefault((user_id, chat_id), []).extend(entries)
+        for entry in entries:
+            self._queue.put(entry)
+
+    def pending(self, user_id, chat_id):
+        """Unflushed turns of one chat, oldest first."""
+        with self._lock:
+            return list(self._pending.get((user_id, chat_id), []))
+
+    def pending_chats(self, user_id):
+        """Unflushed turns of every chat of a user: {chat_id: [turn, ...]}."""
+        with self._lock:
+            return {chat_id: list(entries) for (owner, chat_id), entries in self._pending.items()
+                    if owner == user_id and entries}
+
+    def snapshot(self, read_stored, read_pending, timeout=5.0):
+        """Return (read_stored(), read_pending()) with no batch committed in between.
+
+        Otherwise a batch committing between the two reads would be returned twice (or not
+        at all). Both reads are repeated if a commit overlapped them.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._version_changed.wait_for(lambda: self._version % 2 == 0,
+                                               max(0.0, deadline - time.monotonic()))
+                version = self._version
+            stored = read_stored()
+            pending = read_pending()
+            with self._lock:
+                if self._version == version and version % 2 == 0:
+                    return stored, pending
+            if time.monotonic() > deadline:
+                print("Chat read overlapped a write; returning it as read")
+                return stored, pending
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.max_wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        missing = [entry for entry in batch if entry.embedding is None]
+        if missing:
+            embeddings = self.embeddings_model.embed_documents([entry.message for entry in missing])
+            for entry, embedding in zip(missing, embeddings):
+                entry.embedding = embedding
+        with self._lock:
+            self._version += 1
+        try:
+            stored = self.store_rows([(entry.user_id, entry.chat_id, entry.message, entry.role, entry.embedding)
+                                      for entry in batch])
+            if stored:
+                self._forget(batch)
+        finally:
+            with self._lock:
+                self._version += 1
+                self._version_changed.notify_all()
+        if not stored:
+            raise RuntimeError("chat turns were not stored")
+
+    def _forget(self, batch):
+        written = {entry.seq for entry in batch}
+        with self._lock:
+            for entry in batch:
+                key = (entry.user_id, entry.chat_id)
+                remaining = [turn for turn in self._pending.get(key, []) if turn.seq not in written]
+                if remaining:
+                    self._pending[key] = remaining
+                else:
+                    self._pending.pop(key, None)
+
+    def _persist(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self._write(batch)
+                self._failures = 0
+                return
+            except Exception as e:
+                attempt += 1
+                if self._closed.is_set() and attempt >= CHAT_WRITE_RETRIES:
+                    print(f"Dropping {len(batch)} unsaved chat turns at shutdown: {e}")
+                    self._forget(batch)
+                    return
+                # Later turns wait in the queue (still readable through pending()) until this batch is in
+                delay = min(CHAT_WRITE_RETRY_DELAY * 2 ** self._failures, CHAT_WRITE_MAX_DELAY)
+                self._failures += 1
+                print(f"Error persisting chat turns (attempt {attempt}, retrying in {delay:.2f}s): {e}")
+                self._closed.wait(delay)
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            batch = [entry for entry in taken if entry is not None]
+            if batch:
+                self._persist(batch)
+            for _ in taken:
+                self._queue.task_done()
+            if self._closed.is_set() and self._queue.empty():
+                return
+
+    def flush(self):
+        """Block until every queued turn has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Flush and stop the worker (registered with atexit)."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._queue.put(None)  # wake the worker if it is idle
+        self._queue.join()
+        self._thread.join(timeout=5)
@@ -0,0 +1,91 @@
+import os
+import re
+import hashlib
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+
+# Chunking / embedding configuration
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))  # characters per chunk
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 150))  # characters shared by neighbouring chunks
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))  # texts per embed_documents call
+
+
+def chunk_hash(text):
+    """SHA-256 of the chunk text; matches encode(sha256(convert_to(text, 'UTF8')), 'hex') in SQL."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def match_chunks(chunks, stored):
+    """Match new chunks against the stored chunks of the same file.
+
+    stored maps chunk_hash -> [row_id, ...] and is consumed as rows are matched (repeated
+    texts are matched one to one), so what is left afterwards has vanished from the file.
+    Returns (kept, added): kept pairs a stored row id with the new chunk of the same text
+    (its page/offset may have moved), added are chunks that need embedding.
+    """
+    kept, added = [], []
+    for chunk in chunks:
+        row_ids = stored.get(chunk.metadata["chunk_hash"])
+        if row_ids:
+            kept.append((row_ids.pop(0), chunk))
+        else:
+            added.append(chunk)
+    return kept, added
+
+
+def iter_batches(items, batch_size=EMBEDDING_BATCH_SIZE):
+    """Group any iterable into lists of batch_size (the last one may be shorter)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _tail(text, size):
+    """The last size characters of text, starting at a whitespace boundary where there is one."""
+    if size <= 0:
+        return ""
+    tail = text[-size:]
+    if len(tail) < len(text):
+        boundary = re.search(r"\s", tail)
+        if boundary:
+            tail = tail[boundary.start():]
+    return tail
+
+
+def iter_chunks(documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Lazily split extracted pages into passages, one document at a time.
+
+    Documents with metadata["offset"] are consecutive blocks of one text (TXT blocks, DOCX
+    sections): the tail of the previous block is carried into the next one, so chunks keep the
+    splitter's overlap across block boundaries. Every yielded Document carries metadata["page"]
+    (None for formats without pages), metadata["start_index"], the character offset of the
+    chunk within its page or text, and metadata["chunk_hash"] (see chunk_hash).
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True,
+    )
+    previous = ""
+    for document in documents:
+        offset = document.metadata.get("offset")
+        if offset is None:
+            offset, carry = 0, ""
+        else:
+            carry = _tail(previous, chunk_overlap)
+            previous = document.page_content
+            document = Document(page_content=carry + document.page_content, metadata=document.metadata)
+        for chunk in splitter.split_documents([document]):
+            if not chunk.page_content.strip():
+                continue
+            chunk.metadata = {
+                "page": chunk.metadata.get("page"),
+                "start_index": offset - len(carry) + chunk.metadata.get("start_index", 0),
+                "chunk_hash": chunk_hash(chunk.page_content),
+            }
+            yield chunk
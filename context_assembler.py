@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from embedding_codec import decode_many
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing or encoding files unavailable
+    _encoding = None
+
+# Token budget for everything retrieved into the prompt (chat history + documents + file list)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# Optional per-section caps inside the budget
+CONTEXT_MAX_CHAT_TOKENS = int(os.getenv("CONTEXT_MAX_CHAT_TOKENS", CONTEXT_TOKEN_BUDGET))
+CONTEXT_MAX_DOC_TOKENS = int(os.getenv("CONTEXT_MAX_DOC_TOKENS", CONTEXT_TOKEN_BUDGET))
+CONTEXT_MAX_META_TOKENS = int(os.getenv("CONTEXT_MAX_META_TOKENS", 300))
+# Chat history is the template's first priority, so recent turns get a bonus on top of similarity
+CHAT_RECENCY_BONUS = float(os.getenv("CHAT_RECENCY_BONUS", 0.3))
+# Files are ranked by their best passage score; files without a retrieved passage get this score
+META_BASE_SCORE = float(os.getenv("META_BASE_SCORE", 0.2))
+
+SECTIONS = ("chat_history", "documents", "file_metadata")
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def _chat_similarities(query, chat_rows):
+    """Cosine similarity of each (message, embedding_blob[, codec]) row; 0 for rows without one."""
+    similarities = np.zeros(len(chat_rows), dtype=np.float32)
+    stored = [i for i, row in enumerate(chat_rows) if row[1] is not None]
+    if query is None or not stored:
+        return similarities
+    matrix = decode_many([chat_rows[i][1] for i in stored],
+                         [chat_rows[i][2] if len(chat_rows[i]) > 2 else None for i in stored])
+    if matrix.shape[1] != query.shape[0]:
+        return similarities
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    similarities[stored] = (matrix @ query) / norms
+    return similarities
+
+
+class AssembledContext:
+    """Prompt sections chosen to fit the token budget, plus the tokens each one used."""
+
+    def __init__(self, chat_history, documents, file_metadata, tokens_used, budget):
+        self.chat_history = chat_history
+        self.documents = documents
+        self.file_metadata = file_metadata
+        self.tokens_used = tokens_used
+        self.budget = budget
+
+    @property
+    def other_information(self):
+        return "\n".join(self.documents)
+
+    def token_report(self):
+        return dict(self.tokens_used, total=sum(self.tokens_used.values()), budget=self.budget)
+
+
+def assemble_context(query_embedding, chat_rows=(), doc_matches=(), file_metadata=(),
+                     budget=CONTEXT_TOKEN_BUDGET):
+    """Fill the budget with the highest-scoring items across all three sections.
+
+    chat_rows: (message, embedding_blob, embedding_codec) newest first, as get_recent_chat_embeddings
+    returns them.
+    doc_matches: (score, text, filename) best first.
+    file_metadata: {"name": ..., "doc_preview_link": ...} entries.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32) if query_embedding is not None else None
+    if query is not None and np.linalg.norm(query):
+        query = query / np.linalg.norm(query)
+
+    candidates = []
+    chat_rows = list(chat_rows)
+    similarities = _chat_similarities(query, chat_rows)
+    for position, row in enumerate(chat_rows):
+        recency = CHAT_RECENCY_BONUS / (1 + position)
+        candidates.append((float(similarities[position]) + recency, "chat_history", position, row[0]))
+
+    file_scores = {}
+    for position, (score, text, filename) in enumerate(doc_matches):
+        candidates.append((score, "documents", position, text))
+        file_scores[filename] = max(score, file_scores.get(filename, score))
+
+    for position, entry in enumerate(file_metadata):
+        score = file_scores.get(entry["name"], META_BASE_SCORE)
+        candidates.append((score, "file_metadata", position, entry))
+
+    caps = {
+        "chat_history": CONTEXT_MAX_CHAT_TOKENS,
+        "documents": CONTEXT_MAX_DOC_TOKENS,
+        "file_metadata": CONTEXT_MAX_META_TOKENS,
+    }
+    tokens_used = {section: 0 for section in SECTIONS}
+    chosen = {section: [] for section in SECTIONS}
+    remaining = budget
+    candidates.sort(key=lambda item: item[0], reverse=True)
+    for _, section, position, item in candidates:
+        tokens = count_tokens(item if isinstance(item, str) else str(item))
+        if tokens > remaining or tokens_used[section] + tokens > caps[section]:
+            continue
+        chosen[section].append((position, item))
+        tokens_used[section] += tokens
+        remaining -= tokens
+
+    # Chat and file lists keep their original order; documents stay ordered by relevance
+    return AssembledContext(
+        chat_history=[item for _, item in sorted(chosen["chat_history"], key=lambda pair: pair[0])],
+        documents=[item for _, item in sorted(chosen["documents"], key=lambda pair: pair[0])],
+        file_metadata=[item for _, item in sorted(chosen["file_metadata"], key=lambda pair: pair[0])],
+        tokens_used=tokens_used,
+        budget=budget,
+    )
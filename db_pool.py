@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30.0))  # max wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 30 * 60))  # recycle older connections
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", 10.0))  # ping connections idle longer than this
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+
+class PoolConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of statements already PREPAREd on this connection (see execute_prepared)
+        self.prepared_statements = set()
+
+
+class PooledConnection:
+    """Proxy for a pooled psycopg2 connection; close() hands it back to the pool."""
+
+    __slots__ = ("_pool", "_conn", "_released")
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_released", False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if not self._released:
+            object.__setattr__(self, "_released", True)
+            self._pool.putconn(self._conn)
+
+    def discard(self):
+        """Drop the underlying connection instead of returning it (e.g. after a protocol error)."""
+        if not self._released:
+            object.__setattr__(self, "_released", True)
+            self._pool.putconn(self._conn, discard=True)
+
+
+class ConnectionPool:
+    """Thread-safe pool with a checkout health check and connection-lifetime recycling."""
+
+    def __init__(self, dsn_params, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, check_idle=DB_POOL_CHECK_IDLE):
+        self.dsn_params = dsn_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._idle = []  # (conn, created_at, returned_at), most recently returned last
+        self._created = {}  # id(conn) -> created_at, for connections that are checked out
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                       "timeouts": 0, "created": 0, "recycled": 0, "failed_checks": 0}
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PoolConnection, **self.dsn_params)
+        self._stats["created"] += 1
+        return conn
+
+    def _healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - created_at > self.max_lifetime:
+            self._stats["recycled"] += 1
+            return False
+        if now - returned_at >= self.check_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                self._stats["failed_checks"] += 1
+                return False
+        return True
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.maxconn:
+                    waited = True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                else:
+                    conn, created_at, returned_at = None, None, None
+                    self._size += 1  # reserve the slot before connecting outside the lock
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+            elif not self._healthy(conn, created_at, returned_at):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                continue
+
+            wait_seconds = time.monotonic() - started
+            with self._cond:
+                self._created[id(conn)] = created_at
+                self._stats["checkouts"] += 1
+                self._stats["wait_seconds"] += wait_seconds
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait_seconds)
+                if waited:
+                    self._stats["waits"] += 1
+            return PooledConnection(self, conn)
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            created_at = self._created.pop(id(conn), time.monotonic())
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or time.monotonic() - created_at > self.max_lifetime:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            in_use = self._size - len(self._idle)
+            stats.update(size=self._size, idle=len(self._idle), in_use=in_use, max=self.maxconn,
+                         saturation=in_use / self.maxconn if self.maxconn else 0.0)
+        stats["avg_wait_ms"] = 1000 * stats["wait_seconds"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+
+def execute_prepared(cursor, statements, name, params):
+    """EXECUTE a server-side prepared statement, PREPAREing it on first use per connection."""
+    conn = cursor.connection
+    if name not in conn.prepared_statements:
+        cursor.execute(f"PREPARE {name} AS {statements[name]}")
+        conn.prepared_statements.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
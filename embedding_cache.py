@@ -0,0 +1,111 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# In-process LRU size (entries; one ada-002 vector is ~6 KB)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+# Second tier behind the LRU: "postgres" or "none"
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "postgres").lower()
+# Bounds of the persistent tier, enforced by the background collector (see blob_gc.BlobCollector)
+EMBEDDING_CACHE_MAX_AGE_DAYS = int(os.getenv("EMBEDDING_CACHE_MAX_AGE_DAYS", 30))  # unused entries older than this go
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", 200000))  # least recently used beyond this go
+
+
+def cache_key(model_name, text):
+    """Content hash of the text, salted with the model name so a model change misses."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-hash keyed cache in front of an embeddings model.
+
+    Lookups go to the in-process LRU first, then to the optional persistent tier
+    (persistent_get(keys) -> {key: blob}, persistent_put([(key, model, blob)])),
+    and only the remaining misses are sent to the wrapped model in one batch.
+    """
+
+    def __init__(self, model, model_name, max_entries=EMBEDDING_CACHE_SIZE,
+                 persistent_get=None, persistent_put=None):
+        self.model = model
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.persistent_get = persistent_get
+        self.persistent_put = persistent_put
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+            self._stats["memory_hits"] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.persistent_get is not None:
+            stored = self.persistent_get(missing)
+            for key, blob in stored.items():
+                vector = np.frombuffer(blob, dtype=np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+            with self._lock:
+                self._stats["persistent_hits"] += len(stored)
+        return found
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, in a single model call
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        if pending:
+            with self._lock:
+                self._stats["misses"] += len(pending)
+            computed = self.model.embed_documents(list(pending.values()))
+            new_rows = []
+            for key, embedding in zip(pending, computed):
+                vector = np.asarray(embedding, dtype=np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+                new_rows.append((key, self.model_name, vector.tobytes()))
+            if self.persistent_put is not None:
+                self.persistent_put(new_rows)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key(self.model_name, text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key].tolist()
+        with self._lock:
+            self._stats["misses"] += 1
+        vector = np.asarray(self.model.embed_query(text), dtype=np.float32)
+        self._remember(key, vector)
+        if self.persistent_put is not None:
+            self.persistent_put([(key, self.model_name, vector.tobytes())])
+        return vector.tolist()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Storage format for embedding BYTEA columns; the code is stored per row (embedding_codec)
+# so rows written under different settings decode side by side.
+FLOAT32, FLOAT16, INT8 = 0, 1, 2
+CODECS = {"float32": FLOAT32, "float16": FLOAT16, "int8": INT8}
+EMBEDDING_CODEC = CODECS[os.getenv("EMBEDDING_CODEC", "float32")]
+
+# int8 rows are a little-endian float32 scale followed by the quantized values
+_SCALE_BYTES = 4
+
+
+def encode(embedding, codec=EMBEDDING_CODEC):
+    """Return the BYTEA payload for one embedding in the given codec."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    if codec == FLOAT32:
+        return vector.tobytes()
+    if codec == FLOAT16:
+        return vector.astype("<f2").tobytes()
+    if codec == INT8:
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).astype("<f4").tobytes() + quantized.tobytes()
+    raise ValueError(f"Unknown embedding codec {codec}")
+
+
+def _decode_group(blobs, codec):
+    """Decode same-codec, same-length blobs into one float32 matrix."""
+    joined = b"".join(blobs)
+    if codec == FLOAT32:
+        return np.frombuffer(joined, dtype="<f4").reshape(len(blobs), -1)
+    if codec == FLOAT16:
+        return np.frombuffer(joined, dtype="<f2").reshape(len(blobs), -1).astype(np.float32)
+    if codec == INT8:
+        dim = len(blobs[0]) - _SCALE_BYTES
+        records = np.frombuffer(joined, dtype=np.dtype([("scale", "<f4"), ("values", "i1", (dim,))]))
+        return records["values"].astype(np.float32) * records["scale"][:, None]
+    raise ValueError(f"Unknown embedding codec {codec}")
+
+
+def dimension(blob, codec):
+    if codec == INT8:
+        return len(blob) - _SCALE_BYTES
+    return len(blob) // (2 if codec == FLOAT16 else 4)
+
+
+def decode(blob, codec=FLOAT32):
+    return _decode_group([bytes(blob)], FLOAT32 if codec is None else codec)[0]
+
+
+def decode_many(blobs, codecs=None):
+    """Decode BYTEA rows into one (n, dim) float32 matrix.
+
+    Rows are grouped by (codec, length) and each group is decoded with a single
+    frombuffer call; rows shorter than the widest one are zero-padded.
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    if codecs is None:
+        codecs = [FLOAT32] * len(blobs)
+    blobs = [bytes(blob) for blob in blobs]
+    codecs = [FLOAT32 if codec is None else codec for codec in codecs]
+    groups = {}
+    for i, (blob, codec) in enumerate(zip(blobs, codecs)):
+        groups.setdefault((codec, len(blob)), []).append(i)
+    if len(groups) == 1:
+        (codec, _), = groups
+        return _decode_group(blobs, codec)
+    dim = max(dimension(blob, codec) for blob, codec in zip(blobs, codecs))
+    matrix = np.zeros((len(blobs), dim), dtype=np.float32)
+    for (codec, _), rows in groups.items():
+        decoded = _decode_group([blobs[i] for i in rows], codec)
+        matrix[rows, :decoded.shape[1]] = decoded
+    return matrix
+
+
+# Size / decode speed / recall benchmark: python embedding_codec.py [rows] [dim]
+def benchmark(rows=20000, dim=1536, queries=100, top_k=10, seed=7):
+    rng = np.random.default_rng(seed)
+    # Clustered corpus so neighbours are close, like real document chunks
+    centers = rng.standard_normal((rows // 50, dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, len(centers), rows)] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+    query_rows = corpus[rng.choice(rows, queries, replace=False)]
+    query_rows = query_rows + 0.3 * rng.standard_normal(query_rows.shape).astype(np.float32)
+
+    def normalized(matrix):
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def top(matrix):
+        scores = normalized(query_rows) @ normalized(matrix).T
+        return np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+
+    exact = top(corpus)
+    baseline_bytes = None
+    print(f"{rows} x {dim} vectors, {queries} queries, top-{top_k}")
+    for name, codec in CODECS.items():
+        blobs = [encode(vector, codec) for vector in corpus]
+        total_bytes = sum(len(blob) for blob in blobs)
+        baseline_bytes = baseline_bytes or total_bytes
+        started = time.perf_counter()
+        decoded = decode_many(blobs, [codec] * rows)
+        elapsed = time.perf_counter() - started
+        found = top(decoded)
+        recall = np.mean([len(set(found[i]) & set(exact[i])) / top_k for i in range(queries)])
+        print(f"{name:8s} {total_bytes / rows:8.0f} B/vector  saved {1 - total_bytes / baseline_bytes:6.1%}  "
+              f"decode {rows / elapsed:12.0f} vectors/s  recall@{top_k} {recall:.4f}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    benchmark(*args)
@@ -235,31 +235,34 @@ def chat_interface():
                 with st.chat_message("user"):
                     st.markdown(user_input)
 
-                with st.spinner("Thinking..."):
+                with st.chat_message("assistant"):
                     try:
                         headers = {"Authorization": st.session_state.token}
-                        response = requests.post(
-                            f"{BASE_URL}/ask",
-                            json={"question": user_input, "chatid": active_chat_id},
-                            headers=headers,
-                            timeout=100
-                        )
+                        with st.spinner("Thinking..."):
+                            response = requests.post(
+                                f"{BASE_URL}/ask_stream",
+                                json={"question": user_input, "chatid": active_chat_id},
+                                headers=headers,
+                                stream=True,
+                                timeout=(10, 100)  # connect timeout, max wait between tokens
+                            )
                         if response.status_code == 200:
-                            bot_reply = response.json()["answer"]
+                            response.encoding = response.encoding or "utf-8"
+                            bot_reply = st.write_stream(response.iter_content(chunk_size=None, decode_unicode=True))
                         else:
                             bot_reply = "Something went wrong."
+                            st.markdown(bot_reply)
                             st.sidebar.error(response.json().get("error", "Something went wrong"))
 
                     except requests.exceptions.Timeout:
                         bot_reply = "The server took too long to respond. Please try again."
+                        st.markdown(bot_reply)
 
                     except requests.exceptions.ConnectionError:
                         bot_reply = "Could not connect to the server. Make sure it's running."
-
-                    with st.chat_message("assistant"):
                         st.markdown(bot_reply)
 
-                    messages.append({"role": "assistant", "content": bot_reply})
+                messages.append({"role": "assistant", "content": bot_reply})
 
     else:
         st.warning("Please log in to start chatting.")
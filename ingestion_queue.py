@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+
+# Background ingestion (extract -> chunk -> embed -> store) of uploaded files
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))  # concurrent jobs per process
+INGESTION_POLL_INTERVAL = float(os.getenv("INGESTION_POLL_INTERVAL", 2.0))  # idle seconds between queue checks
+INGESTION_STALE_SECONDS = float(os.getenv("INGESTION_STALE_SECONDS", 300))  # running jobs without a heartbeat are retried
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", 3))
+
+FINISHED_STATUSES = {"done", "failed", "superseded"}
+# Pipeline stages of one uploaded file, reported as skipped when a content-hash match makes them unnecessary
+INGESTION_STAGES = ("store", "extract", "chunk", "embed")
+
+
+class JobSuperseded(Exception):
+    """Raised by a handler when the file was replaced or deleted while its job was queued."""
+
+
+def batch_status(jobs):
+    """Overall status of the jobs created by one upload request."""
+    statuses = {job["status"] for job in jobs}
+    if not statuses:
+        return "unknown"
+    if statuses <= {"done", "superseded"}:
+        return "done"
+    if statuses <= FINISHED_STATUSES:
+        return "failed"
+    if statuses == {"queued"}:
+        return "queued"
+    return "running"
+
+
+class IngestionWorkerPool:
+    """Threads that claim queued jobs from the Postgres job store and run handler(job, progress).
+
+    claim() returns the next job dict (already marked running) or None; update(job_id, **fields)
+    records progress and outcome; requeue_stale(stale_seconds, max_attempts) returns jobs whose
+    worker died (no heartbeat) to the queue. Jobs survive restarts because only the store holds them.
+    """
+
+    def __init__(self, handler, claim, update, requeue_stale, concurrency=INGESTION_WORKERS,
+                 poll_interval=INGESTION_POLL_INTERVAL, stale_seconds=INGESTION_STALE_SECONDS,
+                 max_attempts=INGESTION_MAX_ATTEMPTS):
+        self.handler = handler
+        self.claim = claim
+        self.update = update
+        self.requeue_stale = requeue_stale
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._maintenance_lock = threading.Lock()
+        self._last_maintenance = 0.0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"ingestion-{i}", daemon=True)
+            for i in range(concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        """Wake idle workers (called after new jobs are committed)."""
+        self._wake.set()
+
+    def _maintain(self):
+        with self._maintenance_lock:
+            if time.monotonic() - self._last_maintenance < self.stale_seconds / 2:
+                return
+            self._last_maintenance = time.monotonic()
+        requeued = self.requeue_stale(self.stale_seconds, self.max_attempts)
+        if requeued:
+            print(f"Requeued {requeued} stale ingestion jobs")
+
+    def _process(self, job):
+        def progress(**fields):
+            self.update(job["id"], **fields)
+
+        try:
+            result = self.handler(job, progress) or {}
+            self.update(job["id"], status="done", stage="done", **result)
+        except JobSuperseded:
+            self.update(job["id"], status="superseded", stage="superseded")
+        except Exception as e:
+            print(f"Ingestion job {job['id']} ({job['file_name']}) failed: {e}")
+            self.update(job["id"], status="failed", error=str(e))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                self._maintain()
+                job = self.claim()
+            except Exception as e:
+                print(f"Error claiming ingestion job: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                continue
+            self._process(job)
+
+    def close(self, timeout=10.0):
+        """Stop claiming new jobs; a running job that outlives timeout is retried after restart."""
+        self._stopped.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
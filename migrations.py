@@ -0,0 +1,433 @@
+import sys
+import json
+import uuid
+import numpy as np
+import psycopg2
+import psycopg2.extras
+from embedding_codec import decode
+from Postgres import DB_PARAMS, PGVECTOR_ENABLED, EMBEDDING_DIM, to_vector_literal, query_document_vectors
+
+# Arbitrary key for pg_advisory_lock so concurrent deploys apply migrations one at a time
+MIGRATION_LOCK_KEY = 742_001
+BACKFILL_BATCH_SIZE = 1000
+
+
+def create_index_concurrently(name, definition):
+    """Migration step for CREATE INDEX CONCURRENTLY that also repairs an earlier failed attempt."""
+    def step(cursor):
+        cursor.execute("""
+            SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = %s
+        """, (name,))
+        row = cursor.fetchone()
+        if row and not row[0]:
+            # An interrupted CONCURRENTLY build leaves an INVALID index behind
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+    return step
+
+
+def backfill_document_vectors(cursor):
+    """Copy BYTEA embeddings (any storage codec) into embedding_vec in id order, one batch per commit.
+
+    Blobs of the wrong size are left NULL (those rows are only served by the BYTEA path).
+    """
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'document_embeddings' AND column_name = 'embedding_codec'
+    """)
+    codec_column = "embedding_codec" if cursor.fetchone() else "0"
+    last_id = 0
+    converted = skipped = 0
+    while True:
+        cursor.execute(f"""
+            SELECT id, embedding, {codec_column} FROM document_embeddings
+            WHERE id > %s AND embedding_vec IS NULL AND embedding IS NOT NULL
+            ORDER BY id LIMIT %s
+        """, (last_id, BACKFILL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for row_id, blob, codec in rows:
+            vector = decode(blob, codec)
+            if vector.size != EMBEDDING_DIM:
+                skipped += 1
+                continue
+            updates.append((row_id, to_vector_literal(vector)))
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE document_embeddings AS d SET embedding_vec = v.vec::vector
+            FROM (VALUES %s) AS v (id, vec)
+            WHERE d.id = v.id
+        """, updates)
+        converted += len(updates)
+    print(f"Converted {converted} document embeddings to pgvector ({skipped} skipped)")
+
+
+# (version, name, steps, transactional). Steps are SQL strings or callables taking a cursor.
+# Non-transactional migrations run in autocommit mode (required for CONCURRENTLY).
+MIGRATIONS = [
+    (1, "baseline_schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS document_embeddings (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            filename TEXT,
+            embedding BYTEA,
+            text_snippet TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            newchat_id TEXT,
+            embedding BYTEA,
+            message TEXT,
+            role TEXT CHECK(role IN ('user', 'assistant'))
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_storage (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            file_name TEXT,
+            file_type TEXT,
+            file_size INTEGER,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            used_space INTEGER DEFAULT 0,
+            file_path TEXT,
+            file_oid OID NOT NULL
+        )
+        """,
+    ], True),
+    (2, "document_chunk_locations", [
+        """
+        ALTER TABLE document_embeddings
+            ADD COLUMN IF NOT EXISTS page INTEGER,
+            ADD COLUMN IF NOT EXISTS chunk_offset INTEGER
+        """,
+    ], True),
+    (3, "embedding_cache", [
+        """
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            embedding BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ], True),
+    (4, "hot_query_indexes", [
+        create_index_concurrently("idx_chat_history_user_chat_id", "chat_history (user_id, newchat_id, id)"),
+        create_index_concurrently("idx_document_embeddings_user_filename", "document_embeddings (user_id, filename)"),
+        create_index_concurrently("idx_user_storage_user_file_name", "user_storage (user_id, file_name)"),
+        create_index_concurrently("idx_users_username", "users (username)"),
+    ], False),
+    (6, "embedding_codecs", [
+        # Existing rows are float32 (codec 0); see embedding_codec.py
+        "ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS embedding_codec SMALLINT NOT NULL DEFAULT 0",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS embedding_codec SMALLINT NOT NULL DEFAULT 0",
+    ], True),
+    (7, "ingestion_jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id SERIAL PRIMARY KEY,
+            batch_id TEXT NOT NULL,
+            user_id INTEGER REFERENCES users(id),
+            file_name TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            file_oid OID NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK(status IN ('queued', 'running', 'done', 'failed', 'superseded')),
+            stage TEXT,
+            chunks_total INTEGER,
+            chunks_done INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_queued ON ingestion_jobs (id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_user_batch ON ingestion_jobs (user_id, batch_id)",
+    ], True),
+    (8, "user_storage_content_hash", [
+        # SHA-256 of the uploaded bytes; lets identical re-uploads skip ingestion
+        "ALTER TABLE user_storage ADD COLUMN IF NOT EXISTS content_hash TEXT",
+        create_index_concurrently("idx_user_storage_user_content_hash", "user_storage (user_id, content_hash)"),
+    ], False),
+    (9, "chunk_hashes", [
+        # SHA-256 of each chunk's text; re-uploads only embed chunks whose hash is new
+        "ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS chunk_hash TEXT",
+        "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS chunks_reused INTEGER",
+    ], True),
+    (10, "content_addressed_file_blobs", [
+        # One large object per distinct content, shared by every file row with that hash
+        """
+        CREATE TABLE IF NOT EXISTS file_blobs (
+            content_hash TEXT PRIMARY KEY,
+            oid OID NOT NULL,
+            size BIGINT NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            released_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_file_blobs_oid ON file_blobs (oid)",
+        "CREATE INDEX IF NOT EXISTS idx_file_blobs_released ON file_blobs (released_at) WHERE ref_count <= 0",
+        # Files stored before content hashes existed are hashed from their large object
+        """
+        UPDATE user_storage SET content_hash = encode(sha256(lo_get(file_oid)), 'hex')
+        WHERE content_hash IS NULL
+          AND EXISTS (SELECT 1 FROM pg_largeobject_metadata m WHERE m.oid = user_storage.file_oid)
+        """,
+        """
+        INSERT INTO file_blobs (content_hash, oid, size, ref_count)
+        SELECT content_hash, MIN(file_oid), COALESCE(MAX(file_size), 0), COUNT(*)
+        FROM user_storage
+        WHERE content_hash IS NOT NULL
+        GROUP BY content_hash
+        ON CONFLICT (content_hash) DO NOTHING
+        """,
+        # Duplicate copies are repointed at the shared object and left to the collector
+        """
+        UPDATE ingestion_jobs j SET file_oid = b.oid
+        FROM user_storage s JOIN file_blobs b ON b.content_hash = s.content_hash
+        WHERE j.file_oid = s.file_oid AND s.file_oid <> b.oid
+        """,
+        """
+        UPDATE user_storage s SET file_oid = b.oid
+        FROM file_blobs b
+        WHERE b.content_hash = s.content_hash AND s.file_oid <> b.oid
+        """,
+    ], True),
+    (11, "user_storage_usage", [
+        # Running per-user total of user_storage.file_size, locked by uploads for the quota check
+        """
+        CREATE TABLE IF NOT EXISTS user_storage_usage (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            used_bytes BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        INSERT INTO user_storage_usage (user_id, used_bytes)
+        SELECT user_id, COALESCE(SUM(file_size), 0) FROM user_storage GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET used_bytes = EXCLUDED.used_bytes, updated_at = NOW()
+        """,
+    ], True),
+    (12, "ingestion_chunks", [
+        # Chunks written by a running ingestion job, swapped into document_embeddings at the end.
+        # row_id set: a stored chunk kept with its new page/offset; NULL: a new chunk.
+        """
+        CREATE TABLE IF NOT EXISTS ingestion_chunks (
+            id BIGSERIAL PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES ingestion_jobs(id) ON DELETE CASCADE,
+            row_id INTEGER,
+            embedding BYTEA,
+            embedding_codec SMALLINT NOT NULL DEFAULT 0,
+            text_snippet TEXT,
+            page INTEGER,
+            chunk_offset INTEGER,
+            chunk_hash TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_chunks_job ON ingestion_chunks (job_id)",
+    ], True),
+    (14, "embedding_cache_last_used", [
+        # Pruned by age and row count (see Postgres.prune_embedding_cache)
+        "ALTER TABLE embedding_cache ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP",
+        "UPDATE embedding_cache SET last_used_at = COALESCE(created_at, NOW()) WHERE last_used_at IS NULL",
+        "ALTER TABLE embedding_cache ALTER COLUMN last_used_at SET DEFAULT CURRENT_TIMESTAMP",
+        "ALTER TABLE embedding_cache ALTER COLUMN last_used_at SET NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used_at)",
+    ], True),
+]
+
+# Only applied when VECTOR_BACKEND=pgvector; enabling it later applies it on the next run
+PGVECTOR_MIGRATIONS = [
+    (5, "pgvector_document_embeddings", [
+        "CREATE EXTENSION IF NOT EXISTS vector",
+        f"ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS embedding_vec vector({EMBEDDING_DIM})",
+        backfill_document_vectors,
+        create_index_concurrently("idx_document_embeddings_vec_hnsw",
+                                  "document_embeddings USING hnsw (embedding_vec vector_cosine_ops)"),
+    ], False),
+    (13, "pgvector_ingestion_chunks", [
+        f"ALTER TABLE ingestion_chunks ADD COLUMN IF NOT EXISTS embedding_vec vector({EMBEDDING_DIM})",
+    ], True),
+]
+if PGVECTOR_ENABLED:
+    MIGRATIONS += PGVECTOR_MIGRATIONS
+
+
+def _run_step(cursor, step):
+    if callable(step):
+        step(cursor)
+    else:
+        cursor.execute(step)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(db_params=DB_PARAMS, migrations=MIGRATIONS):
+    """Apply every pending migration once, in version order. Returns the versions applied."""
+    conn = psycopg2.connect(**db_params)
+    conn.autocommit = True
+    applied_now = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        done = applied_versions(cursor)
+        for version, name, steps, transactional in sorted(migrations, key=lambda migration: migration[0]):
+            if version in done:
+                continue
+            print(f"Applying migration {version}: {name}")
+            if transactional:
+                conn.autocommit = False
+                try:
+                    for step in steps:
+                        _run_step(cursor, step)
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+            else:
+                # Every step must be idempotent: a failure here leaves earlier steps applied
+                for step in steps:
+                    _run_step(cursor, step)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            applied_now.append(version)
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.close()
+    return applied_now
+
+
+# Hot queries and the index each one must be able to use
+INDEX_CHECKS = [
+    ("chat history by user/chat",
+     "SELECT message, role FROM chat_history WHERE user_id = 1 AND newchat_id = 'chat_1' ORDER BY id DESC LIMIT 50",
+     "idx_chat_history_user_chat_id"),
+    ("document embeddings by user/file",
+     "SELECT id FROM document_embeddings WHERE user_id = 1 AND filename = 'a.pdf'",
+     "idx_document_embeddings_user_filename"),
+    ("file metadata by user/name",
+     "SELECT file_oid, id FROM user_storage WHERE user_id = 1 AND file_name = 'a.pdf'",
+     "idx_user_storage_user_file_name"),
+    ("user by username",
+     "SELECT id FROM users WHERE username = 'someone'",
+     "idx_users_username"),
+]
+if PGVECTOR_ENABLED:
+    INDEX_CHECKS.append(
+        ("document vector top-k",
+         f"SELECT id FROM document_embeddings ORDER BY embedding_vec <=> array_fill(1, ARRAY[{EMBEDDING_DIM}])::vector LIMIT 10",
+         "idx_document_embeddings_vec_hnsw"))
+
+
+def _plan_indexes(plan):
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= _plan_indexes(child)
+    return names
+
+
+def verify_indexes(db_params=DB_PARAMS, checks=INDEX_CHECKS):
+    """EXPLAIN each hot query with sequential scans disabled and report whether the expected
+    index is used. Returns a list of (description, ok, indexes_used)."""
+    conn = psycopg2.connect(**db_params)
+    results = []
+    try:
+        cursor = conn.cursor()
+        # Small tables would otherwise always be planned as seq scans
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for description, query, index_name in checks:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_indexes(plan[0]["Plan"])
+            results.append((description, index_name in used, sorted(used)))
+        conn.rollback()
+    finally:
+        conn.close()
+    return results
+
+
+def verify_vector_search(db_params=DB_PARAMS, users=20, rows_per_user=200, top_k=10, seed=0):
+    """Check pgvector top-k with many users sharing the HNSW index.
+
+    Synthetic users and vectors are inserted in a transaction that is rolled back. Every user
+    must get top_k of their own rows back, even though most index candidates belong to others.
+    Returns a list of (user number, rows returned, recall against the exact top-k).
+    """
+    rng = np.random.default_rng(seed)
+    conn = psycopg2.connect(**db_params)
+    results = []
+    try:
+        cursor = conn.cursor()
+        vectors = {}
+        for number in range(users):
+            cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id",
+                           (f"vector-check-{number}", uuid.uuid4().hex))
+            user_id = cursor.fetchone()[0]
+            vectors[user_id] = rng.standard_normal((rows_per_user, EMBEDDING_DIM)).astype(np.float32)
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO document_embeddings (user_id, filename, text_snippet, embedding_vec) VALUES %s
+            """, [(user_id, "check.txt", str(i), to_vector_literal(vector))
+                  for i, vector in enumerate(vectors[user_id])], template="(%s, %s, %s, %s::vector)")
+        for number, (user_id, own) in enumerate(vectors.items()):
+            query = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+            found = query_document_vectors(cursor, user_id, to_vector_literal(query), top_k)
+            scores = own @ query / (np.linalg.norm(own, axis=1) * np.linalg.norm(query))
+            exact = {str(i) for i in np.argsort(-scores)[:top_k]}
+            results.append((number, len(found), len(exact & {text for _, text, _ in found}) / top_k))
+    finally:
+        conn.rollback()
+        conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    if "--verify" in sys.argv:
+        failures = 0
+        for description, ok, used in verify_indexes():
+            print(f"{'OK  ' if ok else 'FAIL'} {description}: {', '.join(used) or 'no index'}")
+            failures += not ok
+        if PGVECTOR_ENABLED:
+            top_k = 10
+            for number, returned, recall in verify_vector_search(top_k=top_k):
+                ok = returned == top_k
+                print(f"{'OK  ' if ok else 'FAIL'} vector top-{top_k} for user {number}: "
+                      f"{returned} rows, recall {recall:.2f}")
+                failures += not ok
+        sys.exit(1 if failures else 0)
+    applied = migrate()
+    print(f"Applied migrations: {applied}" if applied else "Database schema is up to date")
@@ -235,6 +235,56 @@ else:
         authenticate_google()
  
     MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+    POLL_INTERVAL = 1.5  # seconds between ingestion status checks
+    MAX_POLL_ERRORS = 10  # consecutive failed status requests before giving up
+    MAX_INGESTION_WAIT = 30 * 60  # seconds to wait for processing to finish
+
+    def wait_for_ingestion(job_id, headers):
+        """Poll the ingestion job until every file is processed, showing per-file progress."""
+        progress_bar = st.progress(0.0, text="📚 Processing your documents...")
+        deadline = time.monotonic() + MAX_INGESTION_WAIT
+        errors = 0
+        while True:
+            if time.monotonic() > deadline:
+                st.error("❌ Processing is taking longer than expected. Your files will keep processing; "
+                         "check back later.")
+                return
+            try:
+                status_response = requests.get(f"{BASE_URL}/ingestion_status/{job_id}", headers=headers, timeout=10)
+            except requests.exceptions.RequestException as e:
+                print(f"Status Error: {e}")  # Debugging
+                errors += 1
+                if errors >= MAX_POLL_ERRORS:
+                    st.error("❌ Lost connection to the server while processing your documents. "
+                             "Please refresh the page later to check on them.")
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            errors = 0
+            if status_response.status_code != 200:
+                st.error(status_response.json().get("error", "❌ Could not get processing status"))
+                return
+            status = status_response.json()
+            files = status.get("files", [])
+            finished = [file for file in files if file["status"] in ("done", "failed", "superseded")]
+            current = next((file for file in files if file["status"] == "running"), None)
+            text = f"📚 Processed {len(finished)}/{len(files)} files"
+            if current:
+                text += f" · {current['file_name']}: {current['stage']}"
+                if current.get("chunks_total"):
+                    text += f" ({current.get('chunks_done') or 0}/{current['chunks_total']} chunks)"
+                elif current.get("chunks_done"):
+                    text += f" ({current['chunks_done']} chunks, {current.get('chunks_per_second') or 0} chunks/s)"
+            progress_bar.progress(len(finished) / len(files) if files else 1.0, text=text)
+            if status["status"] in ("done", "failed"):
+                for file in files:
+                    if file["status"] == "failed":
+                        st.error(f"❌ {file['file_name']} could not be processed: {file.get('error')}")
+                    elif file["status"] == "done" and file.get("chunks_reused"):
+                        st.info(f"♻️ {file['file_name']}: reused {file['chunks_reused']} of "
+                                f"{file.get('chunks_total') or 0} chunks, only the rest were embedded")
+                return
+            time.sleep(POLL_INTERVAL)
  
  
     g_auth_token=st_javascript("sessionStorage.getItem('drive_token');")
@@ -312,25 +362,36 @@ else:
                 upload_button_placeholder.empty()  # Remove button after click
  
                 try:
-                    with st.spinner("⚡Your upload is blasting off in the background! We'll notify you when it's done.... Please wait ⏳"):
+                    with st.spinner("⚡Your upload is blasting off! Please wait ⏳"):
                         response = requests.post(f"{BASE_URL}/upload_documents", files=files_to_send, headers=headers)
-                        if response.status_code == 200:
-                            response=response.json()
-                            st.success(response.get("message"))
-                            updated_files = response.get("files_updated", [])
-                            if updated_files:
-                                file_list_md = "\n".join([f"- {file}" for file in updated_files])
-                                st.success(f"Files updated: {file_list_md}")
-                            if st.button("Upload again ↗️"):
-                                st.components.v1.html("""
-                                    <script>
-                                        localStorage.removeItem("drive_token");
-                                        window.parent.location.reload();
-                                    </script>
-                                    """, height=0, width=0)
-                                st.rerun()
-                        else:
-                            st.error(response.json().get("error", "❌ File upload failed"))
+                    if response.status_code in (200, 202):
+                        response=response.json()
+                        job_id = response.get("job_id")
+                        if job_id:
+                            wait_for_ingestion(job_id, headers)
+                        st.success(response.get("message"))
+                        updated_files = response.get("files_updated", [])
+                        if updated_files:
+                            file_list_md = "\n".join([f"- {file}" for file in updated_files])
+                            st.success(f"Files updated: {file_list_md}")
+                        unchanged_files = response.get("files_unchanged", [])
+                        if unchanged_files:
+                            file_list_md = "\n".join([f"- {file}" for file in unchanged_files])
+                            st.info(f"Already up to date (skipped processing): {file_list_md}")
+                        reused = [name for name, stages in response.get("skipped_stages", {}).items()
+                                  if stages and name not in unchanged_files]
+                        if reused:
+                            st.info(f"Reused text and embeddings of identical documents for: {', '.join(reused)}")
+                        if st.button("Upload again ↗️"):
+                            st.components.v1.html("""
+                                <script>
+                                    localStorage.removeItem("drive_token");
+                                    window.parent.location.reload();
+                                </script>
+                                """, height=0, width=0)
+                            st.rerun()
+                    else:
+                        st.error(response.json().get("error", "❌ File upload failed"))
                            
                 except requests.exceptions.RequestException as e:
                     st.error("❌ Server error! Please try again later.")
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+# PDF text extraction settings
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))  # smaller documents are read in-thread
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))  # page range handed to one worker process
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+PDF_EXTRACTION_CACHE_BYTES = int(os.getenv("PDF_EXTRACTION_CACHE_BYTES", 64 * 1024 * 1024))
+
+_executor = None
+_executor_lock = threading.Lock()
+_cache = OrderedDict()  # content hash -> [page text, ...]
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = {"cache_hits": 0, "cache_misses": 0, "parallel_documents": 0, "pages": 0}
+
+
+def _open(source):
+    """source is a file path or the PDF bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(source)
+
+
+def _extract_range(source, start, end):
+    # Runs in a worker process: each task opens its own document handle
+    with _open(source) as pdf:
+        return [pdf.load_page(number).get_text() for number in range(start, end)]
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Forking a multi-threaded server is not safe. The forkserver preloads only this
+            # module, so workers do not re-import the app (python backend.py) on startup.
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=context)
+        return _executor
+
+
+def _cache_get(content_hash):
+    with _cache_lock:
+        pages = _cache.get(content_hash)
+        if pages is None:
+            _stats["cache_misses"] += 1
+            return None
+        _cache.move_to_end(content_hash)
+        _stats["cache_hits"] += 1
+        return pages
+
+
+def _cache_put(content_hash, pages):
+    global _cache_bytes
+    size = sum(len(text) for text in pages)
+    if size > PDF_EXTRACTION_CACHE_BYTES:
+        return
+    with _cache_lock:
+        if content_hash in _cache:
+            return
+        _cache[content_hash] = pages
+        _cache_bytes += size
+        while _cache_bytes > PDF_EXTRACTION_CACHE_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= sum(len(text) for text in evicted)
+
+
+def _iter_sequential(source):
+    with _open(source) as pdf:
+        for number in range(pdf.page_count):
+            yield pdf.load_page(number).get_text()
+
+
+def _iter_parallel(source, page_count):
+    executor = _get_executor()
+    futures = [executor.submit(_extract_range, source, start, min(start + PDF_PAGES_PER_TASK, page_count))
+               for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    try:
+        # Ranges finish out of order; pages are yielded in order as soon as they are available
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_pdf_pages(source, content_hash=None, parallel_min_pages=PDF_PARALLEL_MIN_PAGES):
+    """Lazily yield (page_number, text) for every page of a PDF (path or bytes).
+
+    Documents with at least parallel_min_pages pages are split into page ranges across a
+    process pool. With a content_hash, a fully read document is cached and later calls for
+    the same content are served from memory.
+    """
+    if content_hash is not None:
+        cached = _cache_get(content_hash)
+        if cached is not None:
+            yield from enumerate(cached)
+            return
+
+    with _open(source) as pdf:
+        page_count = pdf.page_count
+    if page_count >= parallel_min_pages and PDF_EXTRACT_WORKERS > 1:
+        with _cache_lock:
+            _stats["parallel_documents"] += 1
+        pages = _iter_parallel(source, page_count)
+    else:
+        pages = _iter_sequential(source)
+
+    collected = []
+    for number, text in enumerate(pages):
+        collected.append(text)
+        yield number, text
+    with _cache_lock:
+        _stats["pages"] += len(collected)
+    if content_hash is not None:
+        _cache_put(content_hash, collected)
+
+
+def extraction_stats():
+    with _cache_lock:
+        return dict(_stats, cached_documents=len(_cache), cached_bytes=_cache_bytes)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def _synthetic_pdf(pages, lines_per_page=45):
+    pdf = fitz.open()
+    line = "Docze benchmark text: the quick brown fox jumps over the lazy dog 0123456789."
+    for number in range(pages):
+        page = pdf.new_page()
+        page.insert_text((40, 40), "\n".join(f"{number}:{i} {line}" for i in range(lines_per_page)), fontsize=9)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+# Throughput benchmark: python pdf_extraction.py [page counts...]
+def benchmark(page_counts=(1, 10, 200), repeats=3):
+    print(f"workers={PDF_EXTRACT_WORKERS} parallel_min_pages={PDF_PARALLEL_MIN_PAGES} "
+          f"pages_per_task={PDF_PAGES_PER_TASK}")
+    _get_executor().submit(int).result()  # start the pool outside the timings
+    for pages in page_counts:
+        data = _synthetic_pdf(pages)
+        results = {}
+        for name, run in (
+            ("sequential", lambda: list(iter_pdf_pages(data, parallel_min_pages=sys.maxsize))),
+            ("engine", lambda: list(iter_pdf_pages(data))),
+            ("cached", lambda: list(iter_pdf_pages(data, content_hash=f"benchmark-{pages}"))),
+        ):
+            best = float("inf")
+            for _ in range(repeats):
+                started = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - started)
+            results[name] = best
+        print(f"{pages:4d} pages: " + "  ".join(
+            f"{name} {pages / seconds:9.1f} pages/s ({1000 * seconds:7.1f} ms)" for name, seconds in results.items()))
+    shutdown()
+
+
+if __name__ == "__main__":
+    counts = tuple(int(arg) for arg in sys.argv[1:]) or (1, 10, 200)
+    benchmark(counts)
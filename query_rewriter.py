@@ -0,0 +1,193 @@
+import re
+import threading
+
+# List of pronouns to track
+PRONOUNS = {"he", "she", "his", "her", "him", "hers", "they", "them", "their", "theirs",
+            "it", "its", "here", "there", "this", "that", "these", "those"}
+USER_PRONOUNS = {"me", "my", "mine", "myself"}
+
+PERSON_PRONOUNS = {"he", "she", "his", "her", "him", "hers", "they", "them", "their", "theirs"}
+DEMONSTRATIVES = {"this", "that", "these", "those"}
+FILE_NOUNS = {"document", "documents", "doc", "docs", "file", "files", "pdf", "pdfs",
+              "resume", "resumes", "cv", "docx", "txt", "upload", "uploads"}
+# "that" only refers back to something after these words (or at the start of the question)
+THAT_ANTECEDENTS = {"is", "was", "about", "of", "on", "in", "from", "with", "like", "explain",
+                    "describe", "summarize", "summarise", "does", "do", "did", "mean", "means", "what", "whats"}
+EXISTENTIAL_VERBS = {"is", "are", "was", "were"}
+# Words that follow a standalone demonstrative ("is this correct", "what does that mean")
+NOT_DETERMINED = EXISTENTIAL_VERBS | {"s", "one", "about", "mean", "means", "correct", "right", "true",
+                                      "ok", "okay", "good", "work", "works", "say", "says", "do", "does",
+                                      "did", "has", "have", "had", "can", "could", "will", "would", "should"}
+# "it" is only resolved locally as the subject or object of these ("summarize it", "does it mention");
+# anything else, including dummy "it" ("what time is it", "is it possible"), is left to the LLM
+DOCUMENT_VERBS = {"summarize", "summarise", "explain", "describe", "open", "read", "review", "analyze",
+                  "analyse", "check", "say", "says", "said", "mention", "mentions", "contain", "contains",
+                  "cover", "covers", "include", "includes", "list", "lists", "discuss", "discusses",
+                  "state", "states", "show", "shows", "talk", "talks"}
+IT_PREPOSITIONS = {"in", "inside", "within", "from", "of", "about"}
+# Nouns after "its" that belong to a document ("its summary", "its skills section")
+DOCUMENT_PARTS = {"content", "contents", "summary", "text", "title", "author", "conclusion", "introduction",
+                  "section", "sections", "page", "pages", "points", "skills", "experience", "education",
+                  "main", "key", "first", "last"}
+# Nouns that make a demonstrative refer to a person ("this candidate"); left to the LLM
+PERSON_NOUNS = {"candidate", "candidates", "person", "people", "applicant", "applicants", "guy", "guys",
+                "man", "woman", "men", "women", "employee", "employees", "author", "authors", "student",
+                "students", "individual", "individuals", "developer", "developers", "engineer", "engineers",
+                "manager", "managers", "intern", "interns"}
+
+FILE_PATTERN = re.compile(r"[\w\-.]+\.(?:pdf|docx|txt)\b", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"\b\w+\b")
+
+# About-the-user rules: "false" means the question is about the user (skip documents)
+USER_ATTRIBUTES = {"name", "age", "birthday", "email", "phone", "number", "contact", "address",
+                   "nickname", "details", "info", "information", "profile", "location"}
+ABOUT_USER_PHRASES = ("who am i", "about me", "about myself", "remember me", "call me", "know me",
+                      "my name", "do you know me")
+DOCUMENT_WORDS = FILE_NOUNS | {"uploaded", "skills", "experience", "candidate", "candidates", "project", "projects"}
+REQUEST_VERBS = {"tell", "show", "give", "help", "let", "send", "find", "list", "explain", "get"}
+# The user as the subject or topic: "how old am I", "tell me who I am"
+FIRST_PERSON = {"i", "am", "im", "my", "mine", "myself"}
+
+HISTORY_WINDOW = 3  # newest messages searched for an antecedent
+
+
+def extract_files(message):
+    """File names mentioned in a message, in order of appearance."""
+    return list(dict.fromkeys(match.group(0) for match in FILE_PATTERN.finditer(message)))
+
+
+def recent_files(chat_history):
+    """Files of the newest message that mentions any (chat_history is newest first)."""
+    for message in chat_history[:HISTORY_WINDOW]:
+        files = extract_files(message)
+        if files:
+            return files
+    return []
+
+
+class QueryRewriter:
+    """Deterministic resolution of references to files, with an LLM fallback for everything else.
+
+    People ("he", "her", "this candidate") are always resolved by the LLM: names cannot be told
+    apart from other capitalised words (skills, companies) reliably enough by rules. So is "it"
+    unless it is plainly a document being read ("summarize it", "what does it say").
+    """
+
+    def __init__(self, llm_rewrite, llm_about_user):
+        self.llm_rewrite = llm_rewrite
+        self.llm_about_user = llm_about_user
+        self._lock = threading.Lock()
+        self._counters = {"no_rewrite": 0, "local_rewrite": 0, "llm_rewrite": 0,
+                          "local_user_check": 0, "llm_user_check": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["llm_calls"] = stats["llm_rewrite"] + stats["llm_user_check"]
+        stats["llm_calls_saved"] = stats["local_rewrite"] + stats["local_user_check"]
+        return stats
+
+    def rewrite_locally(self, question, chat_history):
+        """Return (rewritten_question, confident); confident=False means ask the LLM."""
+        files = recent_files(chat_history)
+        tokens = list(WORD_PATTERN.finditer(question))
+        replacements = []
+        for i, token in enumerate(tokens):
+            word = token.group(0).lower()
+            if word not in PRONOUNS:
+                continue
+            previous = tokens[i - 1].group(0).lower() if i > 0 else None
+            following = tokens[i + 1].group(0).lower() if i + 1 < len(tokens) else None
+
+            if word in PERSON_PRONOUNS:
+                return question, False
+
+            if word in DEMONSTRATIVES:
+                if word == "that" and previous is not None and previous not in THAT_ANTECEDENTS:
+                    continue  # relative pronoun / conjunction
+                if following in PERSON_NOUNS:
+                    return question, False
+                if following in FILE_NOUNS or following == "one":
+                    if len(files) == 1:
+                        replacements.append((token.start(), tokens[i + 1].end(), files[0]))
+                    elif len(files) > 1:
+                        return question, False
+                    continue
+                if following is not None and following not in NOT_DETERMINED:
+                    continue  # determiner of some other noun ("this role")
+                if len(files) == 1:
+                    replacements.append((token.start(), token.end(), files[0]))
+                    continue
+                return question, False
+
+            if word == "there" and (previous in EXISTENTIAL_VERBS or following in EXISTENTIAL_VERBS):
+                continue  # "is there ...", "there are ..."
+            if word in {"here", "there"}:
+                return question, False
+
+            # "it" / "its"
+            if word == "it":
+                if previous not in DOCUMENT_VERBS and previous not in IT_PREPOSITIONS \
+                        and following not in DOCUMENT_VERBS:
+                    return question, False
+            elif following not in DOCUMENT_PARTS:
+                return question, False
+            if len(files) != 1:
+                return question, False
+            replacements.append((token.start(), token.end(), f"{files[0]}'s" if word == "its" else files[0]))
+
+        rewritten = question
+        for start, end, text in reversed(replacements):
+            rewritten = rewritten[:start] + text + rewritten[end:]
+        return rewritten, True
+
+    def about_user_locally(self, question):
+        """Return "false" if the question is about the user, "true" if not, None if unsure."""
+        lowered = question.lower()
+        words = WORD_PATTERN.findall(lowered)
+        if any(phrase in lowered for phrase in ABOUT_USER_PHRASES):
+            return "false"
+        for i, word in enumerate(words[:-1]):
+            if word == "my" and words[i + 1] in USER_ATTRIBUTES:
+                return "false"
+            if word == "my" and words[i + 1] in DOCUMENT_WORDS:
+                return "true"
+        # Not about the user only when "me" is just the object of a request verb ("tell me about
+        # the resume") and the user is not otherwise the subject or topic
+        objects = [i > 0 and words[i - 1] in REQUEST_VERBS for i, word in enumerate(words) if word == "me"]
+        if objects and all(objects) and FIRST_PERSON.isdisjoint(words):
+            return "true"
+        return None
+
+    def resolve(self, question, chat_history):
+        """Return (relevant_chat_history, question, chat_response) like resolve_pronouns."""
+        if not chat_history:
+            return chat_history, question, "true"
+
+        last_message = chat_history[0]
+        words = set(WORD_PATTERN.findall(question.lower()))
+
+        if words & PRONOUNS:
+            rewritten, confident = self.rewrite_locally(question, chat_history)
+            if confident:
+                self._count("local_rewrite" if rewritten != question else "no_rewrite")
+            else:
+                self._count("llm_rewrite")
+                rewritten = self.llm_rewrite(last_message, question)
+            return [last_message], rewritten, "true"
+
+        if words & USER_PRONOUNS:
+            chat_response = self.about_user_locally(question)
+            if chat_response is not None:
+                self._count("local_user_check")
+            else:
+                self._count("llm_user_check")
+                chat_response = self.llm_about_user(question)
+            return chat_history, question, chat_response
+
+        self._count("no_rewrite")
+        return chat_history, question, "true"
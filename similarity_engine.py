@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from embedding_codec import decode_many
+
+# Memory bound for all cached per-user embedding matrices (bytes)
+MAX_CACHE_BYTES = int(os.getenv("SIMILARITY_CACHE_BYTES", 256 * 1024 * 1024))
+
+
+class UserCorpus:
+    """Pre-normalized embedding matrix, snippet texts and filenames for one user's documents."""
+
+    __slots__ = ("texts", "filenames", "matrix", "nbytes", "fingerprint")
+
+    def __init__(self, texts, filenames, matrix):
+        self.texts = texts
+        self.filenames = filenames
+        self.matrix = matrix
+        self.fingerprint = None
+        self.nbytes = matrix.nbytes + sum(len(text) for text in texts)
+
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_generations = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def decode_embeddings(blobs, codecs=None):
+    """Decode BYTEA blobs (any mix of storage codecs) into one (n, dim) matrix."""
+    return decode_many(blobs, codecs)
+
+
+def build_corpus(rows):
+    """rows: (text, embedding_blob, filename, embedding_codec); the last two are optional."""
+    texts = [row[0] for row in rows]
+    filenames = [row[2] if len(row) > 2 else None for row in rows]
+    codecs = [row[3] if len(row) > 3 else None for row in rows]
+    matrix = normalize_rows(decode_embeddings([row[1] for row in rows], codecs))
+    return UserCorpus(texts, filenames, np.ascontiguousarray(matrix, dtype=np.float32))
+
+
+def _evict_locked():
+    global _cache_bytes
+    while _cache_bytes > MAX_CACHE_BYTES and _cache:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= evicted.nbytes
+        _stats["evictions"] += 1
+
+
+def get_user_corpus(user_id, loader, fingerprint=None):
+    """Return the cached corpus for a user, building it from loader() on a miss.
+
+    loader must return (text_snippet, embedding_blob, filename) rows, as get_document_embeddings does.
+    invalidate_user() only reaches this process's cache; fingerprint() (row_count, max_row_id, see
+    Postgres.get_document_fingerprint) is compared on every call so that writes made by other
+    processes (ingestion workers) are picked up too.
+    """
+    global _cache_bytes
+    expected = fingerprint() if fingerprint is not None else None
+    with _lock:
+        corpus = _cache.get(user_id)
+        if corpus is not None and corpus.fingerprint == expected:
+            _cache.move_to_end(user_id)
+            _stats["hits"] += 1
+            return corpus
+        _stats["misses"] += 1
+        generation = _generations.get(user_id, 0)
+
+    corpus = build_corpus(loader())
+    corpus.fingerprint = expected
+
+    with _lock:
+        # Drop the result if the corpus changed while it was being loaded
+        if _generations.get(user_id, 0) != generation:
+            return corpus
+        if corpus.nbytes <= MAX_CACHE_BYTES:
+            previous = _cache.pop(user_id, None)
+            if previous is not None:
+                _cache_bytes -= previous.nbytes
+            _cache[user_id] = corpus
+            _cache_bytes += corpus.nbytes
+            _evict_locked()
+    return corpus
+
+
+def top_matches(corpus, query_embedding, top_k=1):
+    """Score every document with one matrix-vector product; return [(score, text, filename)] best first."""
+    count = len(corpus.texts)
+    if count == 0 or top_k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm:
+        query = query / norm
+    scores = corpus.matrix @ query
+    if top_k < count:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(count)
+    ordered = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(float(scores[i]), corpus.texts[i], corpus.filenames[i]) for i in ordered]
+
+
+def invalidate_user(user_id):
+    """Forget a user's cached corpus; call whenever their document_embeddings rows change."""
+    global _cache_bytes
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        corpus = _cache.pop(user_id, None)
+        if corpus is not None:
+            _cache_bytes -= corpus.nbytes
+        _stats["invalidations"] += 1
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, users=len(_cache), bytes=_cache_bytes, max_bytes=MAX_CACHE_BYTES)
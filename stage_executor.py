@@ -0,0 +1,87 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STAGE_POOL_SIZE = int(os.getenv("STAGE_POOL_SIZE", 16))  # threads shared by all requests
+STAGE_TIMEOUT = float(os.getenv("STAGE_TIMEOUT", 30.0))  # default per-stage limit (seconds)
+
+_executor = ThreadPoolExecutor(max_workers=STAGE_POOL_SIZE, thread_name_prefix="stage")
+
+
+class Stage:
+    """One unit of work; func is called with the results of deps, in order."""
+
+    def __init__(self, name, func, deps=(), timeout=STAGE_TIMEOUT, default=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.default = default
+
+
+class StageRun:
+    def __init__(self, results, timings, status, total):
+        self.results = results
+        self.timings = timings
+        self.status = status
+        self.total = total
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def report(self):
+        """Per-stage wall time (ms) and outcome, plus the total."""
+        stages = {name: {"ms": round(1000 * seconds, 1), "status": self.status[name]}
+                  for name, seconds in self.timings.items()}
+        return {"stages": stages, "total_ms": round(1000 * self.total, 1)}
+
+
+def run_stages(stages):
+    """Run stages on the shared pool as soon as their dependencies finish.
+
+    A stage that raises or exceeds its timeout yields its default value; stages that
+    depend on it still run with that default. Timed-out work is abandoned, not killed.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.deps) - names
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {sorted(missing)}")
+
+    results, timings, status = {}, {}, {}
+    waiting = list(stages)
+    running = {}
+    run_started = time.perf_counter()
+
+    while waiting or running:
+        for stage in [stage for stage in waiting if all(dep in status for dep in stage.deps)]:
+            waiting.remove(stage)
+            args = [results[dep] for dep in stage.deps]
+            running[_executor.submit(stage.func, *args)] = (stage, time.perf_counter())
+        if not running:
+            raise ValueError(f"Stage dependency cycle: {[stage.name for stage in waiting]}")
+
+        next_deadline = min(started + stage.timeout for stage, started in running.values())
+        done, _ = wait(list(running), timeout=max(0.0, next_deadline - time.perf_counter()),
+                       return_when=FIRST_COMPLETED)
+        now = time.perf_counter()
+        for future in done:
+            stage, started = running.pop(future)
+            timings[stage.name] = now - started
+            try:
+                results[stage.name] = future.result()
+                status[stage.name] = "ok"
+            except Exception as e:
+                print(f"Error in stage {stage.name}: {e}")
+                results[stage.name] = stage.default
+                status[stage.name] = "error"
+        for future, (stage, started) in list(running.items()):
+            if now - started >= stage.timeout:
+                running.pop(future)
+                future.cancel()
+                print(f"Stage {stage.name} timed out after {stage.timeout}s")
+                timings[stage.name] = now - started
+                results[stage.name] = stage.default
+                status[stage.name] = "timeout"
+
+    return StageRun(results, timings, status, time.perf_counter() - run_started)
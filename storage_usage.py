@@ -0,0 +1,45 @@
+import os
+import threading
+
+# Verification of the per-user usage counters (user_storage_usage) against SUM(file_size)
+STORAGE_RECONCILE_INTERVAL = float(os.getenv("STORAGE_RECONCILE_INTERVAL", 6 * 3600))  # seconds between runs
+
+
+def report(corrections):
+    for user_id, counted, actual in corrections:
+        print(f"Storage usage of user {user_id} was {counted} bytes, actual {actual}; corrected")
+    return corrections
+
+
+class UsageReconciler:
+    """Background thread that calls reconcile() -> [(user_id, counted, actual)] every interval.
+
+    Counters are updated in the same transaction as every insert and delete, so corrections
+    point at a write path that bypasses them; each one is logged.
+    """
+
+    def __init__(self, reconcile, interval=STORAGE_RECONCILE_INTERVAL):
+        self.reconcile = reconcile
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="storage-usage", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                report(self.reconcile())
+            except Exception as e:
+                print(f"Error reconciling storage usage: {e}")
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(5.0)
+
+
+# One-off check: python storage_usage.py
+if __name__ == "__main__":
+    from Postgres import reconcile_storage_usage
+
+    corrections = report(reconcile_storage_usage())
+    print(f"{len(corrections)} usage counters corrected")
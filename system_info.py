@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import threading
+import requests
+
+SYSTEM_INFO_URL = os.getenv("SYSTEM_INFO_URL", "http://ip-api.com/json/")
+SYSTEM_INFO_TTL = float(os.getenv("SYSTEM_INFO_TTL", 6 * 60 * 60))  # seconds between refreshes
+SYSTEM_INFO_RETRY = float(os.getenv("SYSTEM_INFO_RETRY", 60))  # first retry after a failed lookup, doubling up to the TTL
+SYSTEM_INFO_TIMEOUT = float(os.getenv("SYSTEM_INFO_TIMEOUT", 3.0))  # hard limit for the lookup
+# JSON object used instead of the network lookup (offline runs, tests)
+SYSTEM_INFO_STATIC = os.getenv("SYSTEM_INFO_STATIC")
+
+FALLBACK_SYSTEM_INFO = {"Location": "Unavailable"}
+
+
+def fetch_location(url=SYSTEM_INFO_URL, timeout=SYSTEM_INFO_TIMEOUT):
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    return {
+        "Country": data.get("country"),
+        "Region": data.get("regionName"),
+        "City": data.get("city"),
+        "Latitude": data.get("lat"),
+        "Longitude": data.get("lon"),
+        "ISP": data.get("isp"),
+        "IP Address": data.get("query")
+    }
+
+
+class SystemInfoProvider:
+    """Serves the server's location from memory and refreshes it in the background.
+
+    get() never waits on the network: until the first lookup succeeds it returns the
+    fallback, and once the value is older than ttl a single background refresh starts.
+    A failed lookup is retried after retry seconds, doubling with each further failure
+    up to ttl, so a transient outage does not leave the fallback in place for hours.
+    """
+
+    def __init__(self, fetch=fetch_location, ttl=SYSTEM_INFO_TTL, fallback=FALLBACK_SYSTEM_INFO,
+                 retry=SYSTEM_INFO_RETRY):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry = retry
+        self.fallback = fallback
+        self._value = None
+        self._refresh_at = 0.0  # monotonic time of the next lookup
+        self._failures = 0
+        self._override = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            value = self.fetch()
+            with self._lock:
+                self._value = value
+                self._failures = 0
+                self._refresh_at = time.monotonic() + self.ttl
+        except Exception as e:
+            with self._lock:
+                # Back off instead of retrying on every request
+                delay = min(self.retry * 2 ** self._failures, self.ttl)
+                self._failures += 1
+                self._refresh_at = time.monotonic() + delay
+            print(f"Error refreshing system information: {e}; retrying in {delay:.0f}s")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or self._override is not None:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="system-info-refresh", daemon=True).start()
+
+    def get(self):
+        with self._lock:
+            if self._override is not None:
+                return dict(self._override)
+            value = self._value
+            stale = time.monotonic() >= self._refresh_at
+        if stale:
+            self.refresh_in_background()
+        return dict(value if value is not None else self.fallback)
+
+    def set_override(self, value):
+        """Pin a fixed value (no network calls); pass None to go back to live lookups."""
+        with self._lock:
+            self._override = value
+
+
+provider = SystemInfoProvider()
+if SYSTEM_INFO_STATIC:
+    provider.set_override(json.loads(SYSTEM_INFO_STATIC))
+
+
+def start():
+    """Resolve the location once at startup without blocking it."""
+    provider.refresh_in_background()
+
+
+def get_system_information():
+    return provider.get()
+
+
+def set_system_information(value):
+    provider.set_override(value)
@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+# TXT reading settings
+TXT_BLOCK_CHARS = int(os.getenv("TXT_BLOCK_CHARS", 64 * 1024))  # characters read and chunked at a time
+
+# Preferred places to end a block, best first
+_BOUNDARIES = ("\n\n", "\n", " ")
+
+
+def _cut(text):
+    """Index to end a block at: the last boundary in its second half, else the full text."""
+    for boundary in _BOUNDARIES:
+        position = text.rfind(boundary, len(text) // 2)
+        if position != -1:
+            return position + len(boundary)
+    return len(text)
+
+
+def iter_text_blocks(source, block_chars=TXT_BLOCK_CHARS):
+    """Lazily yield (offset, text) blocks of a UTF-8 text file (binary file object).
+
+    Blocks end on a paragraph, line or word boundary where possible; the unfinished tail is
+    carried into the next block, so only about two blocks are held in memory at a time.
+    offset is the character position of the block within the file.
+    """
+    reader = io.TextIOWrapper(source, encoding="utf-8")
+    offset, carry = 0, ""
+    while data := reader.read(block_chars):
+        text = carry + data
+        end = _cut(text)
+        if end:
+            yield offset, text[:end]
+        offset, carry = offset + end, text[end:]
+    if carry:
+        yield offset, carry
+    reader.detach()  # the caller owns (and closes) source
+
+
+# Read throughput / peak memory benchmark: python txt_extraction.py [megabytes...]
+def benchmark(sizes_mb=(1, 16, 128)):
+    line = "Docze benchmark text: the quick brown fox jumps over the lazy dog 0123456789.\n"
+    for size_mb in sizes_mb:
+        with tempfile.TemporaryFile() as f:
+            paragraph = (line * 8 + "\n").encode()
+            for _ in range(size_mb * 2**20 // len(paragraph)):
+                f.write(paragraph)
+            f.seek(0)
+            tracemalloc.start()
+            started = time.perf_counter()
+            characters = sum(len(text) for _, text in iter_text_blocks(f))
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print(f"{size_mb:5d} MiB: {characters / elapsed / 2**20:8.1f} Mchars/s  peak {peak / 2**20:6.2f} MiB")
+
+
+if __name__ == "__main__":
+    sizes = tuple(int(arg) for arg in sys.argv[1:]) or (1, 16, 128)
+    benchmark(sizes)
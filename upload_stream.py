@@ -0,0 +1,72 @@
+import os
+import io
+import hashlib
+import tempfile
+
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 4 * 1024 * 1024))  # kept in memory below this size
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", 1024 * 1024))  # bytes per read / large-object write
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class SpooledUpload:
+    """Copy of one uploaded file: in memory up to max_memory bytes, in a temp file beyond.
+
+    The temp file is removed by close(); nothing is left under temp/.
+    """
+
+    def __init__(self, suffix="", max_memory=UPLOAD_SPOOL_BYTES):
+        self.suffix = suffix
+        self.max_memory = max_memory
+        self.size = 0
+        self.path = None  # set once the upload has rolled over to disk
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    def write(self, data):
+        if self._file is None and self.size + len(data) > self.max_memory:
+            handle, self.path = tempfile.mkstemp(prefix="upload-", suffix=self.suffix)
+            self._file = os.fdopen(handle, "wb")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    def open(self):
+        """A fresh binary reader positioned at the start."""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self._buffer.getbuffer())
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self._buffer = None
+
+
+def copy_upload(stream, sinks, limit, block_size=UPLOAD_BLOCK_SIZE):
+    """Read stream once in block_size pieces, hashing it and passing each block to every sink.
+
+    Raises QuotaExceeded as soon as more than limit bytes have been read. Returns (sha256, size).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    while block := stream.read(block_size):
+        size += len(block)
+        if size > limit:
+            raise QuotaExceeded(size)
+        hasher.update(block)
+        for sink in sinks:
+            sink(block)
+    return hasher.hexdigest(), size